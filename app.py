@@ -1,151 +1,174 @@
 import streamlit as st
-import openai
-import json
-import os
-import re
 import random
+import functools
+import audio_format
+import audio_pack
+import compose
+import deadlines
+import manifest
+import metrics
+import openai_client
+from openai_client import CHAT_MODEL, bounded
+import response_bank
+import speculative
+import tts
+import ui
+import upstream
+from phrases import (
+    ALL_RELATIONSHIPS, BUBBLE_FILLERS, BUBBLE_OPENING, BUBBLE_TRY_AGAIN, SARAH_THINKING,
+    bubble_correct, slow_text, wrap_with,
+)
+from ui import COMPOSED_SPEECH, TTS_STREAMING, as_clip, chat_client, client, payload_size, speak
 
 # ---------------- CONFIG ----------------
-api_key = st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
-client = openai.Client(api_key=api_key)
+ui.start_run()
 
 MIN_TURNS_PER_PHOTO = 4
 MAX_TURNS_PER_PHOTO = 6
-TTS_SPEED = 0.75
-
-# All possible relationship options (shown as bubbles)
-ALL_RELATIONSHIPS = ["Mom", "Dad", "Brother", "Sister", "Grandmom", "Granddad", "Cousin", "Aunt", "Uncle"]
+PHOTO_WIDTH = 900  # Matches the .block-container max-width
 
 # ---------------- HELPERS ----------------
-def slow_text(text):
-    """Add pauses between sentences for TTS."""
-    if not text:
-        return ""
-    parts = [p.strip() for p in re.split(r'[.!?]', text) if p.strip()]
-    return ".\n\n\n".join(parts) + "."
-
 def playful_wrap(text):
     """Add playful fillers."""
-    fillers = ["Mmm.", "Oooh.", "Hehe.", "Ahh.", "Yay."]
-    opener = random.choice(fillers)
-    return f"{opener}\n\n{text}"
-
-def sanitize_text(text):
-    if not text:
-        return ""
-    text = re.sub(r"[^\x00-\x7F]+", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-def tts_speak(text):
-    """Call OpenAI TTS."""
-    text = sanitize_text(text)
-    if not text:
-        return None
-    try:
-        speech = client.audio.speech.create(
-            model="tts-1",
-            voice="nova",
-            input=text,
-            speed=TTS_SPEED
-        )
-        return speech.content
-    except Exception as e:
-        st.error(f"TTS failed: {e}")
-        return None
-
-def extract_relationships(description):
-    """Extract relationship words from image description."""
-    relationships = []
-    patterns = ["brother", "mom", "mother", "dad", "father", "grandmom",
-                "grandmother", "granddad", "grandfather", "cousin", "sister", "aunt", "uncle"]
-    desc_lower = description.lower()
-    for rel in patterns:
-        if rel in desc_lower:
-            # Normalize to display form
-            if rel in ["mother", "mom"]:
-                relationships.append("Mom")
-            elif rel in ["father", "dad"]:
-                relationships.append("Dad")
-            elif rel in ["grandmother", "grandmom"]:
-                relationships.append("Grandmom")
-            elif rel in ["grandfather", "granddad"]:
-                relationships.append("Granddad")
-            else:
-                relationships.append(rel.capitalize())
-    return list(set(relationships))
-
-def generate_response(selection, img_description, turn, is_correct, ready_to_move):
-    """Generate Sarah's response based on selection."""
-
-    people_in_photo = extract_relationships(img_description)
-
-    if turn == 1:
-        phase = "OPENING"
-        instruction = "First turn! Be excited about the photo. Ask who they see."
-    elif is_correct and not ready_to_move:
-        phase = "CELEBRATING"
-        instruction = f"They correctly said {selection}! Celebrate big! Then ask 'Who else do you see?'"
-    elif is_correct and ready_to_move:
-        phase = "WRAPPING UP"
-        instruction = f"They said {selection}! Big celebration, then say 'Let's see another photo!'"
-    elif ready_to_move:
-        phase = "WRAPPING UP"
-        instruction = "Time to move on. Celebrate their participation, say 'Let's see another photo!'"
-    else:
-        phase = "ENCOURAGING"
-        instruction = f"They picked {selection}. Be warm and encouraging! Give a gentle hint about someone who IS in the photo: {people_in_photo}"
-
-    prompt = f"""You are Sarah, a warm playful friend talking to My (a young woman).
-
-IMAGE: {img_description}
-TURN: {turn}
-PHASE: {phase}
-MY PICKED: {selection}
-CORRECT: {is_correct}
-
-{instruction}
-
-RULES:
-- Very short sentences (3-6 words max)
-- Be warm, playful, encouraging
-- NEVER say she's wrong
-- Only say "Let's see another photo!" if PHASE is WRAPPING UP
-- Add sounds like "Oooh" or "Mmm" or "Hehe"
-"""
-
+    return wrap_with(random.choice(BUBBLE_FILLERS), text)
+
+def reply_clip(text, deadline=None):
+    """Whole audio for a reply behind a filler: spliced from per-phrase
+    pieces (see compose), or one TTS call for the shaped line."""
+    filler = random.choice(BUBBLE_FILLERS)
+    if COMPOSED_SPEECH:
+        return as_clip(compose.render(client, compose.reply(text, filler), deadline))
+    return as_clip(tts.synthesize(client, wrap_with(filler, slow_text(text)), deadline=deadline))
+
+def speak_reply(text, host, deadline=None):
+    """speak() a reply behind a filler: streamed in streaming mode, else one clip."""
+    if TTS_STREAMING:
+        return speak(playful_wrap(slow_text(text)), host, deadline)
+    return reply_clip(text, deadline)
+
+def opening_clip():
+    """Whole audio for the opening line; every piece is in the audio pack."""
+    if COMPOSED_SPEECH:
+        return as_clip(compose.render(client, compose.reply(BUBBLE_OPENING)))
+    return as_clip(tts.synthesize(client, slow_text(BUBBLE_OPENING)))
+
+def canned_reply(selection, is_correct):
+    """Fallback line for a click, with pre-rendered audio in the audio pack."""
+    if is_correct:
+        return bubble_correct(selection)
+    return BUBBLE_TRY_AGAIN
+
+def canned_audio(text):
+    """Pre-rendered audio for a canned line, or None; never calls out."""
+    if COMPOSED_SPEECH:
+        return as_clip(compose.lookup(compose.reply(text, random.choice(BUBBLE_FILLERS))))
+    return as_clip(tts.lookup(playful_wrap(slow_text(text))))
+
+def generate_response(selection, img, turn, is_correct, ready_to_move, deadline=None):
+    """Generate Sarah's response based on selection.
+
+    Served from the response bank when it has enough variants for this
+    click; otherwise the LLM's reply is used and added to the bank. Falls
+    back to a canned line on failure or when the deadline leaves no time.
+    """
+    phase, _ = response_bank.turn_phase(selection, img["people"], turn, is_correct, ready_to_move)
+    key = response_bank.bank_key(img["id"], phase, selection, is_correct)
+    banked = response_bank.pick(key)
+    if banked:
+        return banked
+    if deadline is not None and not deadline.allows("chat"):
+        deadlines.fell_back("bubbles_text")
+        return canned_reply(selection, is_correct)
+
+    prompt = response_bank.build_prompt(selection, img["description"], img["people"], turn, is_correct, ready_to_move)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        # Sessions on the same photo and click share one call
+        response = upstream.call(
+            "chat",
+            bounded(chat_client, "chat.completions.create", "chat", deadline),
+            key=upstream.request_key(CHAT_MODEL, prompt),
+            deadline=deadline,
+            model=CHAT_MODEL,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=60,
             temperature=0.8
         )
-        return response.choices[0].message.content.strip()
-    except:
-        if is_correct:
-            return f"Yay! You see {selection}! Who else?"
-        return "Mmm, good try! Who else do you see?"
+        openai_client.record_usage("bubbles", response.usage)
+        ai_text = response.choices[0].message.content.strip()
+    except upstream.Abandoned:
+        raise  # Speculation nobody will use; not a fallback
+    except Exception:
+        deadlines.fell_back("bubbles_text")
+        return canned_reply(selection, is_correct)
+    response_bank.add(key, ai_text)
+    return ai_text
+
+def speculate_turn(relationship, img, turn, tier):
+    """Reply text and audio in tier's format for one possible click,
+    computed off the script thread."""
+    is_correct = relationship in img["people"]
+    ready_to_move = turn >= MIN_TURNS_PER_PHOTO
+    ai_text = generate_response(relationship, img, turn, is_correct, ready_to_move)
+    try:
+        audio = audio_format.encoded(reply_clip(ai_text), tier)
+    except Exception:
+        audio = None
+    return ai_text, audio
+
+def ready_to_play(speculated, tier):
+    """Did the speculated turn finish with audio in tier's format? Then
+    its turn has no TTS or encoding left to do."""
+    if speculated is None or not speculated.done() or speculated.cancelled() or speculated.exception():
+        return False
+    result = speculated.result()
+    return result is not None and bool(result[1]) and audio_format.is_encoded(result[1], tier)
+
+def bubble_turn(job, relationship, img, turn, is_correct, ready_to_move, speculated, host, tier, deadline):
+    """One click's reply as a background turn: the text, then its audio.
+
+    Once the turn's deadline leaves no time for TTS, the reply becomes a
+    canned line whose audio is pre-rendered.
+    """
+    turn_metrics = metrics.Turn("bubbles", job.session_id)
+
+    # Serve from the speculative cache, or generate now on a miss
+    with turn_metrics.span("speculative"):
+        result = speculative.wait(speculated, timeout=deadline.remaining())
+    if result:
+        ai_text, audio = result
+    else:
+        with turn_metrics.span("llm"):
+            ai_text = generate_response(relationship, img, turn, is_correct, ready_to_move, deadline)
+        audio = None
+    job.text = ai_text
+
+    if not audio:
+        with turn_metrics.span("tts"):
+            try:
+                if not deadline.allows("speech"):
+                    raise deadlines.DeadlineExceeded("no time left for TTS")
+                audio = speak_reply(ai_text, host, deadline)
+            except deadlines.DeadlineExceeded:
+                deadlines.fell_back("bubbles_audio")
+                job.text = canned_reply(relationship, is_correct)
+                audio = canned_audio(job.text)
+            except Exception as e:
+                job.errors.append(f"TTS failed: {e}")
+    job.audio = audio_format.encoded(audio, tier)
+    turn_metrics.record("audio_bytes", payload_size(job.audio))
+    turn_metrics.finish()
 
 # ---------------- SESSION STATE ----------------
-if "idx" not in st.session_state:
-    st.session_state.idx = 0
-if "turn" not in st.session_state:
-    st.session_state.turn = 0
-if "sarah_text" not in st.session_state:
-    st.session_state.sarah_text = ""
-if "audio_bytes" not in st.session_state:
-    st.session_state.audio_bytes = None
-if "has_spoken" not in st.session_state:
-    st.session_state.has_spoken = False
-if "all_done" not in st.session_state:
-    st.session_state.all_done = False
+ui.init_state()
 if "found_people" not in st.session_state:
     st.session_state.found_people = []
+if "speculator" not in st.session_state:
+    st.session_state.speculator = speculative.Speculator()
 
 # ---------------- DATA ----------------
-with open("data/image_data.json") as f:
-    images = json.load(f)
+images = manifest.photos()
+audio_pack.load()
+metrics.ensure_serving()
 
 total_photos = len(images)
 
@@ -240,105 +263,128 @@ header, footer {visibility: hidden;}
 """, unsafe_allow_html=True)
 
 # ---------------- ALL DONE ----------------
+def reset():
+    """What Start Over clears besides the shared state."""
+    st.session_state.found_people = []
+
 if st.session_state.all_done:
-    st.markdown("<div class='celebration'>All done! Great job, My!</div>", unsafe_allow_html=True)
-    celebration_audio = tts_speak("Yay! All done! Great job My! You did so well! I'm so proud of you!")
-    if celebration_audio:
-        st.audio(celebration_audio, autoplay=True)
-
-    if st.button("Start Over"):
-        st.session_state.idx = 0
-        st.session_state.turn = 0
-        st.session_state.sarah_text = ""
-        st.session_state.audio_bytes = None
-        st.session_state.has_spoken = False
-        st.session_state.all_done = False
-        st.session_state.found_people = []
-        st.rerun()
-    st.stop()
+    ui.all_done(reset)
 
 # ---------------- CURRENT PHOTO ----------------
 current_img = images[st.session_state.idx]
-img_path = os.path.join("assets", current_img["file"])
-people_in_photo = extract_relationships(current_img["description"])
-
-# Progress
-st.markdown(f"<div class='progress'>Photo {st.session_state.idx + 1} of {total_photos}</div>", unsafe_allow_html=True)
-
-# Photo
-if os.path.exists(img_path):
-    st.image(img_path)
+prefetched = ui.show_photo(current_img, total_photos, PHOTO_WIDTH)
 
 # ---------------- INITIAL SPEECH ----------------
 if not st.session_state.has_spoken:
-    opening = "Oooh, look at this photo! Who do you see?"
-    st.session_state.sarah_text = opening
-    st.session_state.audio_bytes = tts_speak(slow_text(opening))
-    st.session_state.has_spoken = True
-    st.session_state.turn = 1
+    ui.say_opening("bubbles", BUBBLE_OPENING, prefetched, opening_clip)
     st.session_state.found_people = []
 
-# Sarah's text
-st.markdown(f"<div class='sarah'>{st.session_state.sarah_text}</div>", unsafe_allow_html=True)
-
-# Show who they've found
-if st.session_state.found_people:
-    found_str = ", ".join(st.session_state.found_people)
-    st.markdown(f"<div class='found'>Found: {found_str}</div>", unsafe_allow_html=True)
-
-# Audio playback
-if st.session_state.audio_bytes:
-    st.audio(st.session_state.audio_bytes, autoplay=True)
-    st.session_state.audio_bytes = None
-
-# ---------------- BUBBLE OPTIONS ----------------
-st.write("")  # Spacing
-
-# Create bubble grid
-cols = st.columns(3)
-for i, relationship in enumerate(ALL_RELATIONSHIPS):
-    col_idx = i % 3
-    with cols[col_idx]:
-        # Dim the button if already found
-        label = f"✓ {relationship}" if relationship in st.session_state.found_people else relationship
-        if st.button(label, key=f"bubble_{relationship}", disabled=(relationship in st.session_state.found_people)):
-            # Handle selection
-            st.session_state.turn += 1
-
-            is_correct = relationship in people_in_photo
-            if is_correct and relationship not in st.session_state.found_people:
-                st.session_state.found_people.append(relationship)
-
-            ready_to_move = st.session_state.turn >= MIN_TURNS_PER_PHOTO
-
-            # Generate response
-            ai_text = generate_response(
-                relationship,
-                current_img["description"],
-                st.session_state.turn,
-                is_correct,
-                ready_to_move
-            )
-
-            st.session_state.sarah_text = ai_text
-            st.session_state.audio_bytes = tts_speak(playful_wrap(slow_text(ai_text)))
-
-            # Check if should advance
-            should_advance = (
-                (ready_to_move and "another photo" in ai_text.lower()) or
-                st.session_state.turn >= MAX_TURNS_PER_PHOTO or
-                (len(st.session_state.found_people) >= len(people_in_photo) and st.session_state.turn >= 3)
-            )
-
-            if should_advance:
-                st.session_state.idx += 1
-                if st.session_state.idx >= total_photos:
-                    st.session_state.all_done = True
-                st.session_state.turn = 0
-                st.session_state.has_spoken = False
-                st.session_state.found_people = []
-
-            st.rerun()
+# ---------------- REPLY ----------------
+def next_photo():
+    """ui.next_photo(), with nobody found yet."""
+    ui.next_photo(total_photos)
+    st.session_state.found_people = []
+
+def finish_turn(job, current_img):
+    """Take in a finished turn's reply, and move to the next photo if it is time."""
+    for message in job.errors:
+        st.error(message)
+    ai_text = job.text or BUBBLE_TRY_AGAIN
+    st.session_state.sarah_text = ai_text
+    st.session_state.audio_clip = job.audio
+
+    # Check if should advance
+    ready_to_move = st.session_state.turn >= MIN_TURNS_PER_PHOTO
+    should_advance = (
+        (ready_to_move and "another photo" in ai_text.lower()) or
+        st.session_state.turn >= MAX_TURNS_PER_PHOTO or
+        (len(st.session_state.found_people) >= len(current_img["people"]) and st.session_state.turn >= 3)
+    )
+    if should_advance:
+        next_photo()
+        ui.rerun()  # New photo: the whole page changes
+
+# ---------------- BUBBLES ----------------
+# A bubble click reruns only this fragment; the style block, progress and
+# photo above render once per photo
+@st.fragment
+def bubbles(current_img):
+    started = ui.fragment_started()
+    people_in_photo = current_img["people"]
+
+    # Sarah's line: the turn's reply as it arrives, or the last one
+    ui.reply(functools.partial(finish_turn, current_img=current_img))
+
+    # Show who they've found
+    if st.session_state.found_people:
+        found_str = ", ".join(st.session_state.found_people)
+        st.markdown(f"<div class='found'>Found: {found_str}</div>", unsafe_allow_html=True)
+
+    # ---------------- BUBBLE OPTIONS ----------------
+    st.write("")  # Spacing
+
+    # Identifies this turn for the speculative cache
+    spec_state = (st.session_state.idx, st.session_state.turn, tuple(st.session_state.found_people))
+
+    # Create bubble grid
+    cols = st.columns(3)
+    for i, relationship in enumerate(ALL_RELATIONSHIPS):
+        col_idx = i % 3
+        with cols[col_idx]:
+            # Dim the button if already found
+            label = f"✓ {relationship}" if relationship in st.session_state.found_people else relationship
+            if st.button(label, key=f"bubble_{relationship}", disabled=(relationship in st.session_state.found_people)):
+                # Handle selection
+                st.session_state.turn += 1
+
+                is_correct = relationship in people_in_photo
+                if is_correct and relationship not in st.session_state.found_people:
+                    st.session_state.found_people.append(relationship)
+
+                ready_to_move = st.session_state.turn >= MIN_TURNS_PER_PHOTO
+
+                # The reply runs in the background and shows up as it lands;
+                # a speculated reply that is ready to play is taken right away
+                speculated = st.session_state.speculator.claim(spec_state, relationship)
+                tier = ui.audio_tier()
+                st.session_state.sarah_text = SARAH_THINKING
+                st.session_state.runner.start(
+                    bubble_turn,
+                    relationship,
+                    current_img,
+                    st.session_state.turn,
+                    is_correct,
+                    ready_to_move,
+                    speculated,
+                    ui.host(),
+                    tier,
+                    deadlines.Deadline(deadlines.TURN_BUDGETS["bubbles"]),
+                    inline=ready_to_play(speculated, tier)
+                )
+                ui.rerun(scope="fragment")
+
+    # ---------------- SPECULATION ----------------
+    # While the child looks at the photo, precompute the likeliest next
+    # clicks: people still to find first, then everyone else
+    remaining = [r for r in ALL_RELATIONSHIPS if r not in st.session_state.found_people]
+    remaining.sort(key=lambda r: r not in people_in_photo)
+    st.session_state.speculator.prepare(
+        spec_state,
+        remaining,
+        functools.partial(
+            speculate_turn,
+            img=current_img,
+            turn=st.session_state.turn + 1,
+            tier=ui.audio_tier()
+        )
+    )
+
+    # ---------------- LOOKAHEAD ----------------
+    ui.look_ahead(images, PHOTO_WIDTH, opening_clip)
+
+    ui.fragment_finished(started)
+
+bubbles(current_img)
 
 # ---------------- NEXT PHOTO BUTTON ----------------
 st.write("")
@@ -347,11 +393,10 @@ col1, col2, col3 = st.columns([1, 1, 1])
 with col2:
     st.markdown('<div class="next-btn">', unsafe_allow_html=True)
     if st.button("Next Photo →"):
-        st.session_state.idx += 1
-        if st.session_state.idx >= total_photos:
-            st.session_state.all_done = True
-        st.session_state.turn = 0
-        st.session_state.has_spoken = False
-        st.session_state.found_people = []
-        st.rerun()
+        st.session_state.runner.supersede()
+        st.session_state.speculator.cancel()
+        next_photo()
+        ui.rerun()
     st.markdown('</div>', unsafe_allow_html=True)
+
+ui.finish_run()
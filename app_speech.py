@@ -1,103 +1,74 @@
 import streamlit as st
-import openai
-import json
 import os
-import re
 import random
+import functools
 import hashlib
+import audio_format
+import audio_pack
+import compose
+import deadlines
+import manifest
+import metrics
+import openai_client
+from openai_client import CHAT_MODEL, TIMEOUTS, bounded
+import pipeline
+import stt
+import tts
+import ui
+import upstream
+import vad
+from phrases import (
+    SARAH_THINKING, SPEECH_FALLBACK, SPEECH_FILLERS, SPEECH_OPENING,
+    add_pauses, slow_opening, wrap_with,
+)
+from relationships import check_success
 from audio_recorder_streamlit import audio_recorder
+from ui import COMPOSED_SPEECH, TTS_STREAMING, as_clip, chat_client, client, payload_size, speak
 
 # ---------------- CONFIG ----------------
-api_key = st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
-client = openai.Client(api_key=api_key)
+ui.start_run()
 
 # Conversation pacing - this is meant to be SLOW and encouraging
 MIN_TURNS_PER_PHOTO = 5   # At least 5 back-and-forth exchanges per photo
 MAX_TURNS_PER_PHOTO = 8   # Move on after 8 turns max
-TTS_SPEED = 0.75
+PHOTO_WIDTH = 800  # Matches the .block-container max-width
+PIPELINED_TURNS = os.getenv("PIPELINED_TURNS") == "1"  # Speak each sentence as soon as it is generated
 
 # ---------------- HELPERS ----------------
-def slow_opening(text):
-    """Extra slow word-by-word pacing for opening lines."""
-    return "\n\n".join(text.split())
-
-def add_pauses(text):
-    """Add longer pauses between sentences for TTS."""
-    if not text:
-        return ""
-    parts = [p.strip() for p in re.split(r'[.!?]', text) if p.strip()]
-    return ".\n\n\n".join(parts) + "."
-
 def playful_wrap(text):
     """Add playful fillers to make responses warmer."""
-    fillers = ["Mmm.", "Oooh.", "Hehe.", "Ahh.", "Ooh."]
-    opener = random.choice(fillers)
-    return f"{opener}\n\n{text}"
-
-def sanitize_text(text):
-    """Clean text for TTS."""
-    if not text:
-        return ""
-    text = re.sub(r"[^\x00-\x7F]+", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-def tts_speak(text):
-    """Call OpenAI TTS with slower speed."""
-    text = sanitize_text(text)
-    if not text:
-        return None
-    try:
-        speech = client.audio.speech.create(
-            model="tts-1",
-            voice="nova",
-            input=text,
-            speed=TTS_SPEED
-        )
-        return speech.content
-    except Exception as e:
-        st.error(f"TTS failed: {e}")
-        return None
+    return wrap_with(random.choice(SPEECH_FILLERS), text)
+
+def speak_reply(text, host, deadline=None):
+    """speak() a reply behind a filler. Spliced from per-phrase pieces (see
+    compose) unless streaming, which needs one TTS request to start early."""
+    filler = random.choice(SPEECH_FILLERS)
+    if COMPOSED_SPEECH and not TTS_STREAMING:
+        return as_clip(compose.render(client, compose.reply(text, filler), deadline))
+    return speak(wrap_with(filler, add_pauses(text)), host, deadline)
+
+def opening_clip():
+    """Whole audio for the word-by-word opening; every piece is in the audio pack."""
+    if COMPOSED_SPEECH:
+        return as_clip(compose.render(client, compose.words(SPEECH_OPENING)))
+    return as_clip(tts.synthesize(client, slow_opening(SPEECH_OPENING)))
+
+# Appended to the system prompt. Everything before the per-photo
+# description stays byte-identical across turns, so the provider can
+# serve it from its prompt cache; the rest of the rules are in the prompt
+TURN_RULES = """
+TURN RULES:
+- Each turn gives the IMAGE DESCRIPTION, TURN NUMBER, PHASE and what My said
+- Follow the INSTRUCTION for the turn
+- Only say "Let's see another photo!" if PHASE is "WRAPPING UP"
+"""
+
+def build_messages(transcript, img_description, sys_prompt, turn_number, is_success, ready_to_move):
+    """Chat messages for one turn, based on turn number and conversation flow.
 
-def extract_relationships(description):
-    """Extract relationship words from image description."""
-    relationships = []
-    patterns = ["brother", "mom", "mother", "dad", "father", "grandmom",
-                "grandmother", "granddad", "grandfather", "cousin", "sister", "aunt", "uncle"]
-    desc_lower = description.lower()
-    for rel in patterns:
-        if rel in desc_lower:
-            relationships.append(rel)
-    return relationships
-
-def check_success(transcript, description):
-    """Check if user correctly named someone in the photo."""
-    transcript_lower = transcript.lower()
-    relationships = extract_relationships(description)
-
-    word_map = {
-        "am": "brother",
-        "nani": "grandmom",
-        "grandmother": "grandmom",
-        "mother": "mom",
-        "father": "dad",
-        "grandfather": "granddad"
-    }
-
-    for rel in relationships:
-        if rel in transcript_lower:
-            return True
-
-    for word, mapped in word_map.items():
-        if word in transcript_lower:
-            for rel in relationships:
-                if mapped == rel or mapped in rel or rel in mapped:
-                    return True
-
-    return False
-
-def generate_ai_response(transcript, img_description, sys_prompt, turn_number, is_success, ready_to_move):
-    """Generate AI response based on turn number and conversation flow."""
+    Static first (system prompt and turn rules), then the photo, then
+    this turn, so consecutive turns share the longest possible prefix.
+    """
 
     # Determine the conversation phase
     if turn_number == 1:
@@ -116,8 +87,7 @@ def generate_ai_response(transcript, img_description, sys_prompt, turn_number, i
         phase = "CONTINUING"
         instruction = "Keep going! Find something new to point out or ask about. Stay playful and encouraging."
 
-    context = f"""
-IMAGE DESCRIPTION: {img_description}
+    context = f"""IMAGE DESCRIPTION: {img_description}
 
 TURN NUMBER: {turn_number}
 PHASE: {phase}
@@ -125,32 +95,105 @@ USER SAID: "{transcript}"
 THEY NAMED SOMEONE CORRECTLY: {"Yes" if is_success else "No"}
 
 INSTRUCTION: {instruction}
-
-RULES:
-- Only mention people from the IMAGE DESCRIPTION
-- Very short sentences (3-6 words)
-- Be warm, playful, encouraging
-- NEVER say the user is wrong
-- Only say "Let's see another photo!" if PHASE is "WRAPPING UP"
 """
 
+    return [
+        {"role": "system", "content": sys_prompt + TURN_RULES},
+        {"role": "user", "content": context}
+    ]
+
+def canned_audio(text):
+    """Pre-rendered audio for a canned line, or None; never calls out."""
+    if COMPOSED_SPEECH:
+        return as_clip(compose.lookup(compose.reply(text, random.choice(SPEECH_FILLERS))))
+    return as_clip(tts.lookup(playful_wrap(add_pauses(text))))
+
+def canned_reply(host, errors, deadline=None):
+    """(SPEECH_FALLBACK, its audio): pre-rendered, else synthesized if there is time."""
+    audio = canned_audio(SPEECH_FALLBACK)
+    if audio is None and (deadline is None or deadline.allows("speech")):
+        try:
+            audio = speak_reply(SPEECH_FALLBACK, host, deadline)
+        except deadlines.DeadlineExceeded:
+            pass
+        except Exception as e:
+            errors.append(f"TTS failed: {e}")
+    return SPEECH_FALLBACK, audio
+
+def generate_ai_response(transcript, img_description, sys_prompt, turn_number, is_success, ready_to_move, errors,
+                         deadline=None):
+    """Generate AI response based on turn number and conversation flow.
+
+    Falls back to a canned line on failure (added to errors) or when the
+    deadline leaves no time.
+    """
+    if deadline is not None and not deadline.allows("chat"):
+        deadlines.fell_back("speech_text")
+        return SPEECH_FALLBACK
+    messages = build_messages(transcript, img_description, sys_prompt, turn_number, is_success, ready_to_move)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": context}
-            ],
+        response = upstream.call(
+            "chat",
+            bounded(chat_client, "chat.completions.create", "chat", deadline),
+            key=upstream.request_key(CHAT_MODEL, messages),
+            deadline=deadline,
+            model=CHAT_MODEL,
+            messages=messages,
             max_tokens=70,
             temperature=0.8
         )
+        openai_client.record_usage("speech", response.usage)
         ai_text = response.choices[0].message.content.strip()
         if not ai_text:
-            return "Mmm, tell me more!"
+            return SPEECH_FALLBACK
         return ai_text
+    except deadlines.DeadlineExceeded:
+        deadlines.fell_back("speech_text")
+        return SPEECH_FALLBACK
+    except Exception as e:
+        errors.append(f"AI error: {e}")
+        deadlines.fell_back("speech_text")
+        return SPEECH_FALLBACK
+
+def generate_and_speak(transcript, img_description, sys_prompt, turn_number, is_success, ready_to_move,
+                       host, errors, on_text=None, deadline=None):
+    """Pipelined turn: stream the reply and synthesize it sentence by sentence.
+
+    Returns (ai_text, audio) so Sarah starts talking before the reply is
+    fully generated. on_text gets the reply before its audio is done.
+    Failures are added to errors. The stream is not hedged; it and each
+    sentence's TTS call are bounded by the deadline, and with too little
+    of it left the stream is not started at all.
+    """
+    if deadline is not None and not deadline.allows("chat"):
+        deadlines.fell_back("speech_text")
+        return canned_reply(host, errors, deadline)
+    messages = build_messages(transcript, img_description, sys_prompt, turn_number, is_success, ready_to_move)
+    try:
+        ai_text, audio = pipeline.speak_pipelined(
+            client,
+            messages,
+            playful_wrap,
+            host=host,
+            stream_audio=TTS_STREAMING,
+            chat_client=chat_client,
+            on_usage=functools.partial(openai_client.record_usage, "speech"),
+            on_text=on_text,
+            deadline=deadline,
+            model=CHAT_MODEL,
+            max_tokens=70,
+            temperature=0.8,
+            timeout=TIMEOUTS["chat"]
+        )
+    except deadlines.DeadlineExceeded:
+        ai_text, audio = "", None
     except Exception as e:
-        st.error(f"AI error: {e}")
-        return "Mmm, tell me more!"
+        errors.append(f"AI error: {e}")
+        ai_text, audio = "", None
+    if not ai_text:
+        deadlines.fell_back("speech_text")
+        return canned_reply(host, errors, deadline)
+    return ai_text, as_clip(audio)
 
 def get_audio_hash(audio_bytes):
     """Get hash of audio bytes to detect duplicates."""
@@ -158,29 +201,76 @@ def get_audio_hash(audio_bytes):
         return None
     return hashlib.md5(audio_bytes).hexdigest()
 
+def speech_turn(job, turn_metrics, speech, request_id, img, sys_prompt, turn_number, ready_to_move, host,
+                tier, deadline):
+    """One recording's reply as a background turn: transcribe it, then
+    the text, then its audio.
+
+    Once the turn's deadline leaves no time for the next stage, the reply
+    becomes the canned line whose audio is pre-rendered.
+    """
+    transcript = ""
+    if speech and deadline.allows("transcription"):
+        try:
+            # Upload straight from memory; the request id keeps concurrent
+            # sessions apart
+            with turn_metrics.span("transcription"):
+                transcript = stt.submit(client, speech, request_id, deadline).result()
+        except deadlines.DeadlineExceeded:
+            deadlines.fell_back("speech_transcript")
+        except Exception as e:
+            job.errors.append(f"Transcription error: {e}")
+    elif speech:
+        deadlines.fell_back("speech_transcript")
+    if not transcript:
+        transcript = "mmm"
+
+    # Check if they named someone
+    is_success = check_success(transcript, img["people"])
+
+    # Generate response
+    turn_args = (transcript, img["description"], sys_prompt, turn_number, is_success, ready_to_move)
+    if PIPELINED_TURNS:
+        with turn_metrics.span("llm_tts_pipelined"):
+            ai_text, audio = generate_and_speak(*turn_args, host, job.errors,
+                                                on_text=functools.partial(setattr, job, "text"),
+                                                deadline=deadline)
+        job.text = ai_text
+    else:
+        with turn_metrics.span("llm"):
+            ai_text = generate_ai_response(*turn_args, job.errors, deadline)
+        job.text = ai_text
+        with turn_metrics.span("tts"):
+            try:
+                if not deadline.allows("speech"):
+                    raise deadlines.DeadlineExceeded("no time left for TTS")
+                audio = speak_reply(ai_text, host, deadline)
+            except deadlines.DeadlineExceeded:
+                deadlines.fell_back("speech_audio")
+                job.text = SPEECH_FALLBACK
+                audio = canned_audio(SPEECH_FALLBACK)
+            except Exception as e:
+                job.errors.append(f"TTS failed: {e}")
+                audio = None
+    job.audio = audio_format.encoded(audio, tier)
+    job.result["transcript"] = transcript
+    turn_metrics.record("audio_bytes", payload_size(job.audio))
+    turn_metrics.finish()
+
 # ---------------- SESSION STATE ----------------
-if "idx" not in st.session_state:
-    st.session_state.idx = 0
-if "turn" not in st.session_state:
-    st.session_state.turn = 0  # Total turns on current photo
-if "sarah_text" not in st.session_state:
-    st.session_state.sarah_text = ""
-if "audio_bytes" not in st.session_state:
-    st.session_state.audio_bytes = None
-if "has_spoken" not in st.session_state:
-    st.session_state.has_spoken = False
-if "all_done" not in st.session_state:
-    st.session_state.all_done = False
+ui.init_state()
 if "last_audio_hash" not in st.session_state:
     st.session_state.last_audio_hash = None
 if "recorder_key" not in st.session_state:
     st.session_state.recorder_key = 0
+if "endpointing" not in st.session_state:
+    st.session_state.endpointing = vad.Endpointing()
 
 # ---------------- DATA ----------------
-with open("data/image_data.json") as f:
-    images = json.load(f)
-with open("system_prompt.txt") as f:
-    sys_prompt = f.read()
+images = manifest.photos()
+sys_prompt = manifest.system_prompt()
+audio_pack.load()
+metrics.ensure_serving()
 
 total_photos = len(images)
 
@@ -249,130 +339,114 @@ div[data-testid="stAudioRecorder"] svg {
 """, unsafe_allow_html=True)
 
 # ---------------- ALL DONE STATE ----------------
+def reset():
+    """What Start Over clears besides the shared state."""
+    st.session_state.last_audio_hash = None
+    st.session_state.recorder_key += 1
+
 if st.session_state.all_done:
-    st.markdown("<div class='celebration'>All done! Great job, My!</div>", unsafe_allow_html=True)
-    celebration_audio = tts_speak("Yay! All done! Great job My! You did so well! I'm so proud of you!")
-    if celebration_audio:
-        st.audio(celebration_audio, autoplay=True)
-
-    if st.button("Start Over"):
-        st.session_state.idx = 0
-        st.session_state.turn = 0
-        st.session_state.sarah_text = ""
-        st.session_state.audio_bytes = None
-        st.session_state.has_spoken = False
-        st.session_state.all_done = False
-        st.session_state.last_audio_hash = None
-        st.session_state.recorder_key += 1
-        st.rerun()
-    st.stop()
+    ui.all_done(reset)
 
 # ---------------- DISPLAY PHOTO ----------------
 current_img = images[st.session_state.idx]
-img_path = os.path.join("assets", current_img["file"])
-
-st.markdown(f"<div class='progress'>Photo {st.session_state.idx + 1} of {total_photos}</div>", unsafe_allow_html=True)
-
-if os.path.exists(img_path):
-    st.image(img_path)
+prefetched = ui.show_photo(current_img, total_photos, PHOTO_WIDTH)
 
 # ---------------- INITIAL SPEECH ----------------
 if not st.session_state.has_spoken:
-    opening = "Oooh, I see a photo! Who is this?"
-    st.session_state.sarah_text = opening
-    st.session_state.audio_bytes = tts_speak(slow_opening(opening))
-    st.session_state.has_spoken = True
-    st.session_state.turn = 1
-
-# ---------------- DISPLAY SARAH TEXT ----------------
-st.markdown(f"<div class='sarah'>{st.session_state.sarah_text}</div>", unsafe_allow_html=True)
-st.markdown("<div class='status'>Tap and hold to talk</div>", unsafe_allow_html=True)
-
-# ---------------- AUDIO PLAY ----------------
-if st.session_state.audio_bytes:
-    st.audio(st.session_state.audio_bytes, autoplay=True)
-    st.session_state.audio_bytes = None
-
-# ---------------- MICROPHONE ----------------
-audio_input = audio_recorder(
-    text="",
-    icon_size="4x",
-    pause_threshold=2.0,
-    sample_rate=16000,
-    key=f"recorder_{st.session_state.recorder_key}"
-)
+    ui.say_opening("speech", SPEECH_OPENING, prefetched, opening_clip)
+
+# ---------------- REPLY ----------------
+def finish_turn(job):
+    """Take in a finished turn's reply, and move to the next photo if it is time."""
+    for message in job.errors:
+        st.error(message)
+    ai_text = job.text or SPEECH_FALLBACK
+    st.session_state.sarah_text = ai_text
+    st.session_state.audio_clip = job.audio
+
+    # Only advance if we've had enough turns AND the AI said to move on
+    should_advance = (
+        st.session_state.turn >= MIN_TURNS_PER_PHOTO and
+        "another photo" in ai_text.lower()
+    ) or st.session_state.turn >= MAX_TURNS_PER_PHOTO
+
+    if should_advance:
+        ui.next_photo(total_photos)
+        st.session_state.last_audio_hash = None
+        ui.rerun()  # New photo: the whole page changes
+
+# ---------------- TALK ----------------
+# A recording reruns only this fragment; the style block, progress and
+# photo above render once per photo
+@st.fragment
+def talk(current_img):
+    started = ui.fragment_started()
+
+    # ---------------- DISPLAY SARAH TEXT ----------------
+    # The turn's reply as it arrives, or the last one
+    ui.reply(finish_turn)
+    st.markdown("<div class='status'>Tap and hold to talk</div>", unsafe_allow_html=True)
+
+    # ---------------- MICROPHONE ----------------
+    audio_input = audio_recorder(
+        text="",
+        icon_size="4x",
+        pause_threshold=st.session_state.endpointing.pause_threshold,
+        sample_rate=16000,
+        key=f"recorder_{st.session_state.recorder_key}"
+    )
+
+    # ---------------- INTERACTION ----------------
+    if audio_input:
+        audio_hash = get_audio_hash(audio_input)
+
+        if audio_hash and audio_hash != st.session_state.last_audio_hash:
+            st.session_state.last_audio_hash = audio_hash
+            st.session_state.turn += 1
+            turn_metrics = metrics.Turn("speech", st.session_state.session_id)
+            turn_metrics.record("recorded_bytes", len(audio_input))
+
+            # Cut the silence the recorder keeps before and after speech
+            with turn_metrics.span("vad"):
+                speech, vad_stats = vad.trim(audio_input)
+            st.session_state.endpointing.update(vad_stats)
+            turn_metrics.record("upload_bytes", len(speech) if speech else 0)
+
+            # Transcription, the reply and its audio run in the background
+            # and show up as they land
+            st.session_state.sarah_text = SARAH_THINKING
+            st.session_state.runner.start(
+                speech_turn,
+                turn_metrics,
+                speech,
+                f"{st.session_state.session_id}-{st.session_state.recorder_key}",
+                current_img,
+                sys_prompt,
+                st.session_state.turn,
+                st.session_state.turn >= MIN_TURNS_PER_PHOTO,
+                ui.host(),
+                ui.audio_tier(),
+                deadlines.Deadline(deadlines.TURN_BUDGETS["speech"])
+            )
+
+            st.session_state.recorder_key += 1
+            ui.rerun(scope="fragment")
+
+    # ---------------- LOOKAHEAD ----------------
+    ui.look_ahead(images, PHOTO_WIDTH, opening_clip)
+
+    ui.fragment_finished(started)
+
+talk(current_img)
 
 # ---------------- SKIP BUTTON ----------------
 col1, col2, col3 = st.columns([1, 1, 1])
 with col2:
     if st.button("Next Photo"):
-        st.session_state.idx += 1
-        if st.session_state.idx >= total_photos:
-            st.session_state.all_done = True
-        st.session_state.turn = 0
-        st.session_state.has_spoken = False
+        st.session_state.runner.supersede()
+        ui.next_photo(total_photos)
         st.session_state.last_audio_hash = None
         st.session_state.recorder_key += 1
-        st.rerun()
+        ui.rerun()
 
-# ---------------- INTERACTION ----------------
-if audio_input:
-    audio_hash = get_audio_hash(audio_input)
-
-    if audio_hash and audio_hash != st.session_state.last_audio_hash:
-        st.session_state.last_audio_hash = audio_hash
-        st.session_state.turn += 1
-
-        # Transcribe
-        transcript = ""
-        try:
-            with open("input.wav", "wb") as f:
-                f.write(audio_input)
-            with open("input.wav", "rb") as f:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=f
-                ).text.strip()
-            os.remove("input.wav")
-        except Exception as e:
-            st.error(f"Transcription error: {e}")
-            transcript = ""
-
-        if not transcript:
-            transcript = "mmm"
-
-        # Check if they named someone
-        is_success = check_success(transcript, current_img["description"])
-
-        # Determine if ready to move (only after minimum turns)
-        ready_to_move = st.session_state.turn >= MIN_TURNS_PER_PHOTO
-
-        # Generate response
-        ai_text = generate_ai_response(
-            transcript,
-            current_img["description"],
-            sys_prompt,
-            st.session_state.turn,
-            is_success,
-            ready_to_move
-        )
-
-        st.session_state.sarah_text = ai_text
-        st.session_state.audio_bytes = tts_speak(playful_wrap(add_pauses(ai_text)))
-
-        # Only advance if we've had enough turns AND the AI said to move on
-        should_advance = (
-            st.session_state.turn >= MIN_TURNS_PER_PHOTO and
-            "another photo" in ai_text.lower()
-        ) or st.session_state.turn >= MAX_TURNS_PER_PHOTO
-
-        if should_advance:
-            st.session_state.idx += 1
-            if st.session_state.idx >= total_photos:
-                st.session_state.all_done = True
-            st.session_state.turn = 0
-            st.session_state.has_spoken = False
-            st.session_state.last_audio_hash = None
-
-        st.session_state.recorder_key += 1
-        st.rerun()
+ui.finish_run()
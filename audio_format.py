@@ -0,0 +1,267 @@
+"""Per-client audio formats, sized to each client's link.
+
+Composed replies come out of compose as 24 kHz PCM WAV, about 384 kbps.
+Over classroom Wi-Fi a few seconds of that can take longer to arrive
+than the reply took to make, and autoplay waits for it.
+
+Each client gets a tier: the best format its link can fetch at least
+HEADROOM times faster than it plays. With sidecar clip URLs on
+(AUDIO_CLIP_URLS), the sidecar times each clip transfer until the client
+has acknowledged every byte and reports it here under the client's
+address, so the clip URLs themselves stay the same for everyone. Clips
+sent inline (the default) go over Streamlit's websocket, where nothing
+tells the server when they arrived, so they are not measured: until a
+client has a measurement it gets START_TIER, which with AUDIO_CLIP_URLS
+off means always. AUDIO_TIER pins one tier for all. Clients that cannot play Ogg (Safari,
+anything on iOS) only get MP3 tiers.
+
+WAV clips are encoded with soundfile (libsndfile >= 1.1 for MP3 and
+Opus). Without a working encoder the only tiers are WAV ones at lower
+sample rates, and they are reported as such. Clips that are already
+compressed (whole lines from the API, the pack's MP3s) pass through.
+Turn jobs encode their reply off the script thread; play() only ever
+uses an encoding that is ready and queues the rest for next time. Bytes
+delivered are recorded per tier.
+"""
+import importlib.util
+import io
+import logging
+import os
+import threading
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import clip_store
+import metrics
+
+# ---------------- CONFIG ----------------
+# Best first. encoding is (libsndfile format, subtype, compression level,
+# bitrate mode), or None for WAV at rate.
+TIERS = {
+    "mp3_128": {"kbps": 128, "encoding": ("MP3", "MPEG_LAYER_III", 0.2, "CONSTANT"), "ogg": False},
+    "mp3_64": {"kbps": 64, "encoding": ("MP3", "MPEG_LAYER_III", 0.6, "CONSTANT"), "ogg": False},
+    "opus_32": {"kbps": 32, "encoding": ("OGG", "OPUS", 0.9, None), "ogg": True},
+    "mp3_32": {"kbps": 32, "encoding": ("MP3", "MPEG_LAYER_III", 0.85, "CONSTANT"), "ogg": False},
+    "opus_16": {"kbps": 16, "encoding": ("OGG", "OPUS", 0.97, None), "ogg": True},
+    # Without an encoder
+    "wav_24k": {"kbps": 384, "encoding": None, "rate": 24000, "ogg": False},
+    "wav_16k": {"kbps": 256, "encoding": None, "rate": 16000, "ogg": False},
+    "wav_8k": {"kbps": 128, "encoding": None, "rate": 8000, "ogg": False},
+}
+AUDIO_TIER = os.getenv("AUDIO_TIER", "auto")  # auto, or a tier name for every client
+START_TIER = os.getenv("AUDIO_START_TIER", "mp3_64")  # the middle usable tier if unusable
+HEADROOM = 10  # a tier needs a link this many times its bitrate
+MIN_MEASURE_BYTES = 32 * 1024  # shorter transfers are mostly round-trip time
+LINK_WEIGHT = 0.5  # weight of the newest measurement in a client's estimate
+MAX_CLIENTS = 4096
+MAX_ENCODED = 4096
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "2"))
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_links = OrderedDict()  # client -> estimated kbps, least recently measured first
+_encoded = OrderedDict()  # (clip key, tier) -> encoded clip key
+_tier_of = {}  # encoded clip key -> tier, for reporting
+_pending = set()  # (clip key, tier) being encoded for a later play()
+_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+_encoder = None
+
+# ---------------- BANDWIDTH ----------------
+def client_of(headers, address):
+    """Which client a request came from: the first X-Forwarded-For hop
+    behind a proxy, else its address. Loopback is one client whatever its
+    spelling (Streamlit reports it as None)."""
+    forwarded = (headers.get("X-Forwarded-For") or "").split(",")[0].strip()
+    client = forwarded or address or "127.0.0.1"
+    if client == "::1" or client.startswith(("127.", "::ffff:127.")):
+        return "127.0.0.1"
+    return client
+
+def observe_transfer(client, n_bytes, seconds):
+    """Fold one clip transfer, timed until the client acknowledged it,
+    into the client's bandwidth estimate."""
+    if not client or n_bytes < MIN_MEASURE_BYTES or seconds <= 0:
+        return
+    kbps = n_bytes * 8 / 1000 / seconds
+    metrics.observe("client_link_kbps", kbps)
+    with _lock:
+        previous = _links.pop(client, None)
+        _links[client] = kbps if previous is None else LINK_WEIGHT * kbps + (1 - LINK_WEIGHT) * previous
+        while len(_links) > MAX_CLIENTS:
+            _links.popitem(last=False)
+
+def link_kbps(client):
+    """The client's estimated bandwidth, or None before any measurement."""
+    with _lock:
+        return _links.get(client)
+
+def plays_ogg(user_agent):
+    """Can this browser play Ogg Opus? WebKit on Apple devices cannot."""
+    if "iPhone" in user_agent or "iPad" in user_agent:
+        return False
+    return "Safari" not in user_agent or "Chrome" in user_agent or "Android" in user_agent
+
+def can_encode():
+    """Is a soundfile with MP3 and Opus support installed?"""
+    global _encoder
+    if _encoder is None:
+        _encoder = False
+        if importlib.util.find_spec("soundfile") is not None:
+            try:
+                import soundfile
+
+                _encoder = "MP3" in soundfile.available_formats() and "OPUS" in soundfile.available_subtypes("OGG")
+            except Exception as e:
+                log.warning("soundfile unusable, sending WAV: %s", e)
+        if not _encoder:
+            log.warning("No MP3/Opus encoder (pip install soundfile); compact tiers are WAV at lower rates")
+    return _encoder
+
+def tier_for(client, user_agent=""):
+    """The best tier the client's link and browser can take."""
+    if AUDIO_TIER != "auto":
+        return AUDIO_TIER
+    compressed = can_encode()
+    playable = [name for name, tier in TIERS.items()
+                if (tier["encoding"] is not None) == compressed and (plays_ogg(user_agent) or not tier["ogg"])]
+    kbps = link_kbps(client)
+    if kbps is None:
+        return START_TIER if START_TIER in playable else playable[len(playable) // 2]
+    for name in playable:
+        if kbps >= TIERS[name]["kbps"] * HEADROOM:
+            return name
+    return playable[-1]
+
+# ---------------- ENCODING ----------------
+def _soundfile_encode(wav_bytes, tier):
+    import soundfile
+
+    container, subtype, level, mode = TIERS[tier]["encoding"]
+    data, rate = soundfile.read(io.BytesIO(wav_bytes), dtype="int16")
+    out = io.BytesIO()
+    soundfile.write(out, data, rate, format=container, subtype=subtype, compression_level=level,
+                    bitrate_mode=mode)
+    return out.getvalue()
+
+def _downsample(wav_bytes, tier):
+    from compose import resample
+
+    with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    to_rate = TIERS[tier]["rate"]
+    if channels != 1 or width != 2 or rate <= to_rate:
+        return wav_bytes
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(to_rate)
+        w.writeframes(resample(raw, rate, to_rate))
+    return out.getvalue()
+
+def encode(wav_bytes, tier):
+    """A WAV in the tier's format. Raises if the tier needs an encoder
+    that is not installed."""
+    if TIERS[tier]["encoding"] is None:
+        return _downsample(wav_bytes, tier)
+    return _soundfile_encode(wav_bytes, tier)
+
+def _is_wav(audio):
+    if not isinstance(audio, clip_store.Clip):
+        return False
+    stored = clip_store.get(audio.key)
+    return stored is not None and stored[1] == "audio/wav"
+
+def _ready(audio, tier):
+    """A new handle to the clip's encoding for tier, if it is stored."""
+    with _lock:
+        encoded_key = _encoded.get((audio.key, tier))
+    stored = clip_store.get(encoded_key) if encoded_key else None
+    return clip_store.put(stored[0], stored[1]) if stored else None
+
+def is_encoded(audio, tier):
+    """Would encoded(audio, tier) return without encoding?"""
+    if not _is_wav(audio):
+        return True
+    with _lock:
+        encoded_key = _encoded.get((audio.key, tier))
+    return encoded_key is not None and clip_store.get(encoded_key) is not None
+
+def encoded(audio, tier):
+    """The clip in the tier's format, encoding it now if needed (so call
+    it off the script thread). Anything but a WAV clip comes back as is,
+    and so does the WAV if encoding fails."""
+    if not _is_wav(audio):
+        return audio
+    ready = _ready(audio, tier)
+    if ready:
+        return ready
+    stored = clip_store.get(audio.key)
+    if stored is None:
+        return audio
+    try:
+        with metrics.span("audio_encode"):
+            data = encode(stored[0], tier)
+    except Exception as e:
+        log.warning("Encoding to %s failed, sending WAV: %s", tier, e)
+        return audio
+    result = clip_store.put(data)
+    with _lock:
+        _encoded[(audio.key, tier)] = result.key
+        _tier_of[result.key] = tier
+        while len(_encoded) > MAX_ENCODED:
+            _tier_of.pop(_encoded.popitem(last=False)[1], None)
+    return result
+
+def _encode_later(audio, tier):
+    try:
+        encoded(audio, tier)
+    finally:
+        with _lock:
+            _pending.discard((audio.key, tier))
+
+def deliver(audio, tier):
+    """The clip to send a client on tier, without waiting: its encoding if
+    ready, else the clip as it is, with the encoding queued for the next
+    time it plays. Records the bytes delivered and in what format."""
+    if not isinstance(audio, clip_store.Clip):
+        return audio  # A stream URL: sent as the API produces it
+    with _lock:
+        label = _tier_of.get(audio.key, "as_is")
+    if _is_wav(audio):
+        ready = _ready(audio, tier)
+        if ready:
+            audio, label = ready, tier
+        else:
+            label = "wav_unencoded"
+            with _lock:
+                queue = (audio.key, tier) not in _pending
+                _pending.add((audio.key, tier))
+            if queue:
+                _executor.submit(_encode_later, audio, tier)
+    metrics.inc(f"audio_delivered_{label}")
+    metrics.observe("audio_bytes_delivered", audio.size)
+    return audio
+
+# ---------------- REPORTING ----------------
+def stats():
+    """Clips and bytes delivered, by format (a tier name, "as_is" for clips
+    that came compressed, "wav_unencoded" when no encoding was ready),
+    plus encoding time and the client link measurements (none unless
+    clips go through the sidecar)."""
+    snapshot = metrics.snapshot()
+    counters = dict(metrics.counters)
+    delivered = snapshot.get("audio_bytes_delivered", {})
+    prefix = "audio_delivered_"
+    return {
+        "clips": delivered.get("count", 0),
+        "bytes": delivered.get("sum", 0),
+        "formats": {name[len(prefix):]: n for name, n in sorted(counters.items()) if name.startswith(prefix)},
+        "encoder": "soundfile" if can_encode() else "none (WAV tiers)",
+        "encode_p50": snapshot.get("audio_encode", {}).get("p50"),
+        "link_kbps_p50": snapshot.get("client_link_kbps", {}).get("p50"),
+        "links_measured": snapshot.get("client_link_kbps", {}).get("count", 0),
+    }
@@ -0,0 +1,166 @@
+"""Pre-rendered audio for every deterministic line the apps speak.
+
+Build once per photo set:
+
+    python audio_pack.py --workers 4
+
+The pack is a single file: a small header, a JSON index of
+key -> (offset, length), then the raw clips back to back. The apps mmap
+it at startup so lookups cost a dict access and a slice.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ---------------- CONFIG ----------------
+PACK_PATH = os.getenv("AUDIO_PACK_PATH", "data/audio_pack.bin")
+MAGIC = b"APK1"
+HEADER = struct.Struct("<4sI")
+
+_lock = threading.Lock()
+_pack = None
+
+# ---------------- LOADING ----------------
+def load(path=PACK_PATH):
+    """Map the pack into memory once per process. Missing pack is fine."""
+    global _pack
+    with _lock:
+        if _pack is not None:
+            return _pack
+        _pack = ({}, None)
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return _pack
+        magic, index_len = HEADER.unpack_from(mm, 0) if len(mm) >= HEADER.size else (b"", 0)
+        if magic != MAGIC:
+            mm.close()
+            return _pack
+        index = json.loads(mm[HEADER.size:HEADER.size + index_len])
+        _pack = (index, mm)
+        return _pack
+
+def get(key):
+    """Return the pre-rendered clip for a cache key, or None."""
+    index, mm = _pack if _pack is not None else load()
+    entry = index.get(key)
+    if entry is None:
+        return None
+    offset, length = entry
+    return mm[offset:offset + length]
+
+# ---------------- BUILDING ----------------
+def utterances(images):
+    """Every shaped line the apps can send to TTS without an LLM call."""
+    import phrases
+    from phrases import slow_text, add_pauses, slow_opening, wrap_with
+    from relationships import extract_relationships
+
+    lines = [
+        slow_text(phrases.BUBBLE_OPENING),
+        slow_opening(phrases.SPEECH_OPENING),
+        phrases.CELEBRATION,
+    ]
+    lines += phrases.BUBBLE_FILLERS + phrases.SPEECH_FILLERS
+
+    # Correct-pick fallbacks only matter for people who appear in a photo
+    people = {rel for img in images for rel in extract_relationships(img["description"])}
+    picks = [rel for rel in phrases.ALL_RELATIONSHIPS if rel in people]
+    bubble_fallbacks = [phrases.bubble_correct(rel) for rel in picks] + [phrases.BUBBLE_TRY_AGAIN]
+    for text in bubble_fallbacks:
+        for filler in phrases.BUBBLE_FILLERS:
+            lines.append(wrap_with(filler, slow_text(text)))
+    for filler in phrases.SPEECH_FILLERS:
+        lines.append(wrap_with(filler, add_pauses(phrases.SPEECH_FALLBACK)))
+
+    return list(dict.fromkeys(lines))
+
+def composed_phrases(images):
+    """Every phrase composed speech can need without an LLM call: fillers,
+    canned lines sentence by sentence, and opening words."""
+    import compose
+    import phrases
+    from relationships import extract_relationships
+
+    people = {rel for img in images for rel in extract_relationships(img["description"])}
+    lines = [phrases.bubble_correct(rel) for rel in phrases.ALL_RELATIONSHIPS if rel in people]
+    lines += [phrases.BUBBLE_OPENING, phrases.CELEBRATION, phrases.BUBBLE_TRY_AGAIN, phrases.SPEECH_FALLBACK]
+    plans = [compose.reply(line) for line in lines] + [compose.words(phrases.SPEECH_OPENING)]
+    plans += [compose.reply("", filler) for filler in phrases.BUBBLE_FILLERS + phrases.SPEECH_FILLERS]
+    return list(dict.fromkeys(phrase for plan in plans for phrase in compose.phrases_of(plan)))
+
+def write_pack(clips, path):
+    """Write {key: bytes} as one indexed bundle, atomically."""
+    keys = sorted(clips)
+    # Offsets depend on the index size, which depends on the offsets;
+    # repeat until the encoded index stops changing length.
+    index = {key: [0, len(clips[key])] for key in keys}
+    blob = b""
+    while True:
+        offset = HEADER.size + len(blob)
+        for key in keys:
+            index[key][0] = offset
+            offset += len(clips[key])
+        encoded = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        if len(encoded) == len(blob):
+            blob = encoded
+            break
+        blob = encoded
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(blob)))
+        f.write(blob)
+        for key in keys:
+            f.write(clips[key])
+    os.replace(tmp, path)
+
+def build(data_path, out_path, workers):
+    import compose
+    import openai_client
+    import tts
+    from phrases import sanitize_text
+
+    with open(data_path) as f:
+        images = json.load(f)
+    # Whole lines for streamed or uncomposed speech, phrases as raw PCM for compose
+    lines = [(line, tts.TTS_FORMAT) for line in utterances(images)]
+    lines += [(phrase, compose.PHRASE_FORMAT) for phrase in composed_phrases(images)]
+    client = openai_client.get_client()
+
+    clips = {}
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(tts.synthesize, client, line, fmt=fmt): (line, fmt) for line, fmt in lines}
+        for future in as_completed(futures):
+            line, fmt = futures[future]
+            try:
+                audio = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"failed: {line!r}: {e}", file=sys.stderr)
+                continue
+            if audio:
+                clips[tts.clip_key(sanitize_text(line), fmt)] = bytes(audio)
+
+    write_pack(clips, out_path)
+    size = sum(len(c) for c in clips.values())
+    print(f"{len(clips)} clips, {size / 1024:.0f} KB -> {out_path} ({failed} failed)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render the app's canned speech.")
+    parser.add_argument("--data", default="data/image_data.json")
+    parser.add_argument("--out", default=PACK_PATH)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    sys.exit(build(args.data, args.out, args.workers))
@@ -0,0 +1,253 @@
+"""Small HTTP sidecar that serves audio straight to the browser.
+
+st.audio can only take a finished payload or a URL. To start playback
+before synthesis finishes we hand the browser a URL on this server and
+feed the response body chunk by chunk as TTS produces it.
+
+With AUDIO_CLIP_URLS=1, finished clips from clip_store are also handed
+out as /clip/<key> URLs with immutable cache headers, so a clip the
+browser already has is never sent twice. Like streaming, that is opt-in:
+the browser must reach this port on the page's scheme (an HTTPS page
+blocks plain-HTTP audio), so behind HTTPS or a firewall set
+AUDIO_BASE_URL to a same-origin proxy path. By default clips go inline
+with the page, which always plays.
+
+Each clip transfer is timed until the client has acknowledged every
+byte (not just until it is handed to the kernel, which buffers most of a
+clip) and feeds that client's bandwidth estimate in audio_format.
+
+The server runs on a daemon thread, once per process, started on first
+use by streaming or clip URLs; browsers fetch from it, so it listens on
+every interface. It serves nothing else (metrics has its own loopback
+listener). Set AUDIO_BASE_URL when the apps sit behind a proxy;
+otherwise the URL is built from the host the browser used to reach
+Streamlit. Give each app its own AUDIO_SERVER_PORT when both run on one
+machine.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import audio_format
+import clip_store
+
+# ---------------- CONFIG ----------------
+AUDIO_SERVER_HOST = os.getenv("AUDIO_SERVER_HOST", "0.0.0.0")
+AUDIO_SERVER_PORT = int(os.getenv("AUDIO_SERVER_PORT", "8599"))
+AUDIO_BASE_URL = os.getenv("AUDIO_BASE_URL", "")
+AUDIO_CLIP_URLS = os.getenv("AUDIO_CLIP_URLS") == "1"  # Needs the sidecar reachable from the browser
+STREAM_TTL = 300  # seconds a finished stream stays fetchable
+CLIP_MAX_AGE = 365 * 24 * 3600  # clip URLs are content-addressed, so they never change
+DRAIN_TIMEOUT = 10  # seconds to wait for a client to acknowledge a clip
+DRAIN_POLL = 0.005
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_server = None
+_streams = {}
+
+# ---------------- STREAMS ----------------
+class AudioStream:
+    """Audio bytes that arrive over time and can be read while growing."""
+
+    def __init__(self, content_type="audio/mpeg"):
+        self.content_type = content_type
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.timings = None
+        self.created = time.monotonic()
+        self._cond = threading.Condition()
+
+    def feed(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def read(self):
+        """Yield chunks in order, waiting for new ones until closed."""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.chunks) and not self.done:
+                    self._cond.wait(timeout=30)
+                if i >= len(self.chunks):
+                    return
+                chunk = self.chunks[i]
+            i += 1
+            yield chunk
+
+    def content(self):
+        return b"".join(self.chunks)
+
+def register(stream):
+    """Make a stream fetchable and return its path."""
+    now = time.monotonic()
+    stream_id = uuid.uuid4().hex
+    with _lock:
+        for old_id, old in list(_streams.items()):
+            if old.done and now - old.created > STREAM_TTL:
+                del _streams[old_id]
+        _streams[stream_id] = stream
+    return f"/stream/{stream_id}"
+
+# ---------------- HTTP ----------------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        handler = ROUTES.get(parts[0])
+        if handler is None or len(parts) > 2:
+            self.send_error(404)
+            return
+        handler(self, parts[1] if len(parts) == 2 else "")
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_chunked(self, chunks, content_type, headers=()):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+def _serve_stream(handler, stream_id):
+    with _lock:
+        stream = _streams.get(stream_id)
+    if stream is None:
+        handler.send_error(404)
+        return
+    handler.send_chunked(stream.read(), stream.content_type, [("Cache-Control", "no-store")])
+
+def _serve_clip(handler, key):
+    clip = clip_store.get(key)
+    if clip is None:
+        handler.send_error(404)
+        return
+    data, content_type = clip
+    etag = f'"{key}"'
+    if handler.headers.get("If-None-Match") == etag:
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        return
+    # Safari will not play audio from a server that ignores Range
+    start, end = 0, len(data) - 1
+    byte_range = handler.headers.get("Range", "")
+    if byte_range.startswith("bytes=") and "," not in byte_range:
+        first, _, last = byte_range[6:].partition("-")
+        try:
+            if first:
+                start, end = int(first), min(int(last), end) if last else end
+            elif last:
+                start = max(0, len(data) - int(last))
+        except ValueError:
+            start, end = 0, len(data) - 1
+        if start > end:
+            handler.send_response(416)
+            handler.send_header("Content-Range", f"bytes */{len(data)}")
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        handler.send_response(206)
+        handler.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+    else:
+        handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(end - start + 1))
+    handler.send_header("Accept-Ranges", "bytes")
+    handler.send_header("Cache-Control", f"public, max-age={CLIP_MAX_AGE}, immutable")
+    handler.send_header("ETag", etag)
+    handler.end_headers()
+    start_time = time.perf_counter()
+    try:
+        handler.wfile.write(data[start:end + 1])
+        handler.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        handler.close_connection = True
+        return
+    if end - start + 1 >= audio_format.MIN_MEASURE_BYTES and _drain(handler.connection):
+        audio_format.observe_transfer(audio_format.client_of(handler.headers, handler.client_address[0]),
+                                      end - start + 1, time.perf_counter() - start_time)
+
+def _unacked(sock):
+    """Bytes sent on sock that the peer has not acknowledged yet (Linux
+    SIOCOUTQ), or None where the platform cannot say."""
+    try:
+        import fcntl
+        import termios
+
+        return struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0" * 4))[0]
+    except (ImportError, AttributeError, OSError):
+        return None
+
+def _drain(sock):
+    """Wait until the peer has acknowledged everything sent on sock.
+    False if that cannot be known or takes over DRAIN_TIMEOUT."""
+    give_up = time.perf_counter() + DRAIN_TIMEOUT
+    while True:
+        unacked = _unacked(sock)
+        if unacked is None or time.perf_counter() > give_up:
+            return False
+        if unacked == 0:
+            return True
+        time.sleep(DRAIN_POLL)
+
+ROUTES = {
+    "stream": _serve_stream,
+    "clip": _serve_clip,
+}
+
+def ensure_started():
+    """Start the sidecar once per process."""
+    global _server
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((AUDIO_SERVER_HOST, AUDIO_SERVER_PORT), _Handler)
+            except OSError as e:
+                # Usually the other app already holds the port
+                log.warning("Audio sidecar not started on port %s: %s", AUDIO_SERVER_PORT, e)
+                _server = False
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="audio-server", daemon=True).start()
+    return _server or None
+
+def url_for(path, host=None):
+    """Absolute URL the browser can fetch for a server path."""
+    if AUDIO_BASE_URL:
+        return AUDIO_BASE_URL.rstrip("/") + path
+    hostname = (host or "localhost").rsplit(":", 1)[0]
+    return f"http://{hostname}:{AUDIO_SERVER_PORT}{path}"
+
+def playable(audio, host=None):
+    """What to hand st.audio: a stream URL as-is, and for a Clip its bytes
+    inline, or with AUDIO_CLIP_URLS its /clip URL if the sidecar runs."""
+    if not isinstance(audio, clip_store.Clip):
+        return audio
+    if AUDIO_CLIP_URLS and ensure_started():
+        return url_for(f"/clip/{audio.key}", host)
+    return clip_store.get(audio.key)[0]
@@ -0,0 +1,445 @@
+"""End-to-end benchmark: both apps, headless, against a local mock OpenAI.
+
+Drives full sessions through Streamlit's AppTest: bubble clicks or
+recorded-audio turns, one "Next Photo", through to the all-done screen.
+Reports per-turn wall time, script runs, bytes sent to the browser,
+upstream calls and prompt tokens, with no network and no API spend.
+Exits 1 if any chat call went over its prompt's token budget.
+
+    python bench.py --profile typical
+    python bench.py --app speech --profile slow --json out.json
+    python bench.py --app speech --backend local   # vs. the default remote
+"""
+import argparse
+import dataclasses
+import io
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import wave
+from collections import Counter
+
+from mock_openai import PROFILES, MockOpenAI
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+TIMEOUT = 120  # seconds per script run
+
+# ---------------- HELPERS ----------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_recording(voice_seconds=1.0, silence_seconds=2.0, rate=16000, seed=0):
+    """16 kHz mono WAV: a tone, then the trailing silence the recorder keeps."""
+    frames = bytearray()
+    for i in range(int(voice_seconds * rate)):
+        sample = int(8000 * math.sin(2 * math.pi * (220 + seed) * i / rate))
+        frames += sample.to_bytes(2, "little", signed=True)
+    frames += bytes(2 * int(silence_seconds * rate))
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return out.getvalue()
+
+_media_loaded = {}
+_sent = [0]  # forward message bytes; meaningful for one session at a time
+_click = threading.local()
+
+def record_media():
+    """Count what script runs send the browser: every forward message
+    (deltas, widget state) and every media file (image, audio) handed
+    over. Also lets a step target a fragment the way the browser does
+    when a widget inside one is used."""
+    from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner_utils.script_requests import ScriptRequests
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    load = MemoryMediaFileStorage.load_and_get_id
+    enqueue = ForwardMsgQueue.enqueue
+    request_rerun = LocalScriptRunner.request_rerun
+
+    def load_and_record(self, path_or_data, *args, **kwargs):
+        file_id = load(self, path_or_data, *args, **kwargs)
+        _media_loaded[file_id] = len(self._files_by_id[file_id].content)
+        return file_id
+
+    def enqueue_and_count(self, msg):
+        _sent[0] += msg.ByteSize()
+        return enqueue(self, msg)
+
+    def request_fragment_rerun(self, rerun_data):
+        fragment_id = getattr(_click, "fragment_id", None)
+        if fragment_id:
+            # Each AppTest run starts a new runner with a full rerun queued,
+            # which would swallow the fragment one; a live session has none
+            self._requests = ScriptRequests()
+            rerun_data = dataclasses.replace(rerun_data, fragment_id=fragment_id)
+        return request_rerun(self, rerun_data)
+
+    MemoryMediaFileStorage.load_and_get_id = load_and_record
+    ForwardMsgQueue.enqueue = enqueue_and_count
+    LocalScriptRunner.request_rerun = request_fragment_rerun
+
+def setup_environment(mock, cold, backend="remote"):
+    """Point the apps at the mock and at scratch caches. Call before
+    importing any app module."""
+    scratch = tempfile.mkdtemp(prefix="bench-")
+    os.environ["STT_BACKEND"] = os.environ["TTS_BACKEND"] = backend
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = mock.base_url
+    os.environ["METRICS_LOG"] = os.path.join(scratch, "metrics.jsonl")
+    os.environ.setdefault("AUDIO_SERVER_PORT", str(free_port()))
+    os.environ.setdefault("METRICS_PORT", str(free_port()))
+    if cold:
+        os.environ["TTS_CACHE_DIR"] = os.path.join(scratch, "tts")
+        os.environ["AUDIO_PACK_PATH"] = os.path.join(scratch, "no_pack.bin")
+        os.environ["RESPONSE_BANK_PATH"] = os.path.join(scratch, "response_bank.json")
+        os.environ["PHOTO_CACHE_DIR"] = os.path.join(scratch, "photos")
+    return scratch
+
+class Session:
+    """One headless app session with per-turn accounting.
+
+    think_time pauses before each action (uniformly 0.5-1.5x), like a
+    child looking at the photo; it is not counted in the turn's wall time.
+    With link_kbps set, each turn reports a clip transfer at that speed
+    for the client, as the audio sidecar would for a real one.
+    """
+
+    link_kbps = None
+
+    def __init__(self, app, mock, think_time=0.0):
+        from streamlit.testing.v1 import AppTest
+
+        self.mock = mock
+        self.think_time = think_time
+        self.at = AppTest.from_file(os.path.join(APP_DIR, app), default_timeout=TIMEOUT)
+        self.at.secrets["OPENAI_API_KEY"] = "bench"
+        self.seen_media = set()
+        self.turns = []
+
+    def _browser_bytes(self, sent, media):
+        """Forward messages plus media not already sent this session."""
+        total = sent
+        for file_id, size in media.items():
+            if file_id not in self.seen_media:
+                self.seen_media.add(file_id)
+                total += size
+        return total
+
+    def _fragment_id(self, nested=False):
+        """The app's top-level fragment, or the one nested in it, if there
+        is exactly one."""
+        parents = self.at._fragment_storage._parent_by_id
+        fragments = [f for f, parent in parents.items() if (parent is not None) == nested]
+        return fragments[0] if len(fragments) == 1 else None
+
+    def _await_turn(self, start):
+        """Poll like the browser's run_every timer until the session's
+        background turn is done. Returns (seconds until Sarah's text
+        showed, number of polls)."""
+        import time
+        import turns
+        from phrases import SARAH_THINKING
+
+        text_at, polls = None, 0
+        page = self.at._tree
+        photo = (self.state["idx"], self.state["all_done"])
+        while True:
+            if text_at is None and self.state["sarah_text"] != SARAH_THINKING:
+                text_at = time.perf_counter() - start
+            runner = self.state["runner"] if "runner" in self.state else None
+            if runner is None or runner.job is None:
+                return text_at, polls
+            time.sleep(turns.POLL_INTERVAL)
+            _click.fragment_id = self._fragment_id(nested=True)
+            try:
+                self.at.run()
+            finally:
+                _click.fragment_id = None
+            polls += 1
+            if self.at.exception:
+                raise RuntimeError(f"App raised: {self.at.exception[0].value}")
+            if (self.state["idx"], self.state["all_done"]) == photo:
+                # Only the polled fragment ran. The browser keeps everything
+                # outside it; AppTest only has what this run drew
+                self.at._tree = page
+
+    def step(self, kind, action=None, in_fragment=False):
+        """Run one turn (action then script run, then polls until its
+        background work lands) and record what it cost.
+
+        in_fragment marks an action on a widget inside the app's fragment,
+        which the browser answers with a fragment-only rerun. The wall
+        time runs to the end of the turn; "response" is until the first
+        script run returned and "text" until Sarah's reply showed.
+        """
+        import time
+        import metrics
+
+        if action and self.think_time:
+            time.sleep(self.think_time * random.uniform(0.5, 1.5))
+        if self.link_kbps:
+            import audio_format
+
+            n_bytes = audio_format.MIN_MEASURE_BYTES
+            audio_format.observe_transfer(audio_format.client_of({}, None), n_bytes,
+                                          n_bytes * 8 / 1000 / self.link_kbps)
+        calls_before, _ = self.mock.snapshot()
+        runs_before = metrics.snapshot().get("rerun", {}).get("count", 0)
+        audio_before = metrics.snapshot().get("audio_bytes_delivered", {}).get("sum", 0)
+        _media_loaded.clear()
+        sent_before = _sent[0]
+        idx_before = self.state["idx"] if "idx" in self.state else None
+        _click.fragment_id = self._fragment_id() if in_fragment else None
+        start = time.perf_counter()
+        try:
+            (action() if action else self.at).run()
+        finally:
+            _click.fragment_id = None
+        response = time.perf_counter() - start
+        if self.at.exception:
+            raise RuntimeError(f"App raised: {self.at.exception[0].value}")
+        text, polls = self._await_turn(start)
+        wall = time.perf_counter() - start
+        sent = _sent[0] - sent_before
+        media = dict(_media_loaded)
+        calls_after, _ = self.mock.snapshot()
+        self.turns.append({
+            "kind": kind,
+            "wall": wall,
+            "response": response,
+            "text": text if text is not None else wall,
+            "polls": polls,
+            "runs": metrics.snapshot().get("rerun", {}).get("count", 0) - runs_before,
+            "browser_bytes": self._browser_bytes(sent, media),
+            "audio_bytes": metrics.snapshot().get("audio_bytes_delivered", {}).get("sum", 0) - audio_before,
+            "upstream": dict(calls_after - calls_before),
+            "new_photo": idx_before is not None and self.state["idx"] != idx_before,
+        })
+
+    @property
+    def state(self):
+        return self.at.session_state
+
+# ---------------- SESSIONS ----------------
+def run_bubble_session(mock, skip_photo=1, think_time=0.0):
+    import manifest
+
+    photos = manifest.photos()
+    session = Session("app.py", mock, think_time)
+    session.step("load")
+    while not session.state["all_done"]:
+        idx = session.state["idx"]
+        if idx == skip_photo:
+            session.step("next_photo", lambda: session.at.button[-1].click())
+            continue
+        found = session.state["found_people"]
+        people = photos[idx]["people"]
+        # The child finds people in the photo first, then guesses
+        order = [p for p in people if p not in found] + ["Sister", "Aunt", "Uncle", "Cousin", "Dad", "Mom"]
+        choice = next(p for p in order if p not in found)
+        session.step("click", lambda: session.at.button(key=f"bubble_{choice}").click(), in_fragment=True)
+    return session
+
+_recordings = {}  # session_id -> recordings waiting to be "spoken"
+
+def _fake_recorder(**kwargs):
+    import streamlit as st
+
+    pending = _recordings.get(st.session_state.get("session_id"))
+    return pending.pop() if pending else None
+
+def run_speech_session(mock, skip_photo=1, transcripts=("Am", "mom", "I don't know", "Nani"), think_time=0.0):
+    import audio_recorder_streamlit
+
+    # The app imports audio_recorder on every run, so this takes effect
+    audio_recorder_streamlit.audio_recorder = _fake_recorder
+    mock.set_transcripts(transcripts)
+
+    session = Session("app_speech.py", mock, think_time)
+    session.step("load")
+    pending = _recordings[session.state["session_id"]] = []
+    turn = 0
+    while not session.state["all_done"]:
+        if session.state["idx"] == skip_photo:
+            session.step("next_photo", lambda: session.at.button[-1].click())
+            continue
+        turn += 1
+        pending.append(make_recording(seed=turn))
+        session.step("speech", lambda: session.at, in_fragment=True)
+    _recordings.pop(session.state["session_id"], None)
+    return session
+
+RUNNERS = {"bubbles": run_bubble_session, "speech": run_speech_session}
+
+# ---------------- REPORT ----------------
+def pct(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def summarize(name, turns):
+    walls = [t["wall"] for t in turns]
+    interactive = [t for t in turns if t["kind"] in ("click", "speech")]
+    advances = [t["wall"] for t in turns if t.get("new_photo")]
+    upstream = Counter()
+    for t in interactive:
+        upstream.update(t["upstream"])
+    n = max(1, len(interactive))
+    return {
+        "app": name,
+        "turns": len(turns),
+        "wall_p50": statistics.median(walls) if walls else 0.0,
+        "wall_p95": pct(walls, 0.95),
+        "wall_max": max(walls, default=0.0),
+        "runs_per_turn": sum(t["runs"] for t in turns) / max(1, len(turns)),
+        "browser_kb_per_turn": sum(t["browser_bytes"] for t in turns) / max(1, len(turns)) / 1024,
+        "interactive_wall_p50": statistics.median(t["wall"] for t in interactive) if interactive else 0.0,
+        "interactive_wall_max": max((t["wall"] for t in interactive), default=0.0),
+        "interactive_kb_per_turn": sum(t["browser_bytes"] for t in interactive) / n / 1024,
+        "audio_kb_per_turn": sum(t["audio_bytes"] for t in interactive) / n / 1024,
+        "response_p50": statistics.median(t["response"] for t in interactive) if interactive else 0.0,
+        "text_p50": statistics.median(t["text"] for t in interactive) if interactive else 0.0,
+        "polls_per_turn": sum(t["polls"] for t in interactive) / n,
+        "new_photo_wall_p50": statistics.median(advances) if advances else 0.0,
+        "upstream_per_turn": {k: round(v / n, 2) for k, v in sorted(upstream.items())},
+    }
+
+def format_upstream(endpoint, s):
+    """One line of upstream.stats() for an endpoint."""
+    waits = "/".join("-" if w is None else f"{w * 1000:.0f}" for w in s["wait_p95"].values())
+    depth = "-" if s["queue_depth_p95"] is None else f"{s['queue_depth_p95']:.0f}"
+    return (f"{endpoint} {s['requests']} sent, {s['merged']} merged;"
+            f" queue depth p95 {depth}, wait p95 {waits} ms (interactive/background)")
+
+def print_report(summaries):
+    for s in summaries:
+        print(f"\n== {s['app']} ({s['turns']} turns)")
+        print(f"  wall per turn  p50 {s['wall_p50'] * 1000:7.0f} ms   p95 {s['wall_p95'] * 1000:7.0f} ms"
+              f"   max {s['wall_max'] * 1000:7.0f} ms")
+        print(f"  script runs    {s['runs_per_turn']:.2f} per turn")
+        print(f"  to browser     {s['browser_kb_per_turn']:.1f} KB per turn")
+        print(f"  interactive    p50 {s['interactive_wall_p50'] * 1000:.0f} ms,"
+              f" {s['interactive_kb_per_turn']:.1f} KB to browser per turn")
+        print(f"  audio          {s['audio_kb_per_turn']:.1f} KB per interactive turn")
+        print(f"  progressive    screen responds p50 {s['response_p50'] * 1000:.0f} ms,"
+              f" text p50 {s['text_p50'] * 1000:.0f} ms, {s['polls_per_turn']:.1f} polls per turn")
+        print(f"  new photo      p50 {s['new_photo_wall_p50'] * 1000:.0f} ms per turn that moves on")
+        calls = ", ".join(f"{k} {v}" for k, v in s["upstream_per_turn"].items()) or "none"
+        print(f"  upstream calls {calls} per interactive turn")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app", choices=["bubbles", "speech", "both"], default="both")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="typical")
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--warm", action="store_true", help="keep the real TTS cache, audio pack and response bank")
+    parser.add_argument("--backend", choices=["remote", "local"], default="remote",
+                        help="speech engines: OpenAI (mocked) or in-process, falling back to remote")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds between taps")
+    parser.add_argument("--tier", help="audio format for every session (see audio_format.TIERS)")
+    parser.add_argument("--link-kbps", type=float, help="client bandwidth each session reports")
+    parser.add_argument("--json", help="write per-turn rows to this file")
+    args = parser.parse_args(argv)
+
+    mock = MockOpenAI(args.profile).start()
+    setup_environment(mock, cold=not args.warm, backend=args.backend)
+    if args.tier:
+        os.environ["AUDIO_TIER"] = args.tier
+    Session.link_kbps = args.link_kbps
+    record_media()
+    os.chdir(APP_DIR)
+
+    apps = list(RUNNERS) if args.app == "both" else [args.app]
+    summaries, rows = [], []
+    for app in apps:
+        turns = []
+        for _ in range(args.sessions):
+            turns += RUNNERS[app](mock, think_time=args.think).turns
+        summaries.append(summarize(app, turns))
+        rows += [{"app": app, **t} for t in turns]
+    mock.stop()
+
+    print_report(summaries)
+    import openai_client
+
+    pool = openai_client.pool_stats()
+    handshake = f"{pool['handshake_p50'] * 1000:.1f} ms p50" if pool["handshake_p50"] is not None else "n/a"
+    print(f"\n== upstream connections: {pool['opened']} opened, {pool['reused']} reused, handshake {handshake}")
+    import upstream
+
+    for endpoint, s in upstream.stats().items():
+        if s["requests"] or s["merged"]:
+            print(f"== upstream {format_upstream(endpoint, s)}")
+    over_budget = 0
+    for app in apps:
+        usage = openai_client.usage_stats(app)
+        over_budget += usage["over_budget"]
+        if usage["calls"]:
+            print(f"== {app} prompt: {usage['prompt']:.0f} tokens per chat call ({usage['cached']:.0f} cached),"
+                  f" {usage['completion']:.0f} completion; {usage['over_budget']} of {usage['calls']} calls"
+                  f" over the {usage['budget']}-token budget")
+    if "bubbles" in apps:
+        import response_bank
+
+        print(f"== response bank: {response_bank.hit_rate():.0%} of bubble replies served without the LLM")
+    import speculative
+
+    print(f"== lookahead: {speculative.lookahead_hit_rate():.0%} of new photos loaded in advance")
+    import deadlines
+
+    tails = deadlines.stats()
+    for stage, s in tails["stages"].items():
+        if any(s.values()):
+            print(f"== {stage} tail: {s['hedged']} hedged ({s['hedge_won']} won by the hedge,"
+                  f" {s['hedge_skipped']} skipped for lack of a slot), {s['timed_out']} out of time")
+    import compose
+
+    composed = compose.stats()
+    speech_calls = mock.calls["speech"]
+    print(f"== speech: {speech_calls} TTS calls, {mock.speech_chars} input chars"
+          f" ({mock.speech_chars / max(1, speech_calls):.0f} per call)")
+    if composed["clips"]:
+        phrases = composed["cached"] + composed["synthesized"]
+        print(f"== composed speech: {composed['clips']} clips, {composed['cached']} of {phrases} phrases"
+              f" from pack or cache")
+    import audio_format
+
+    delivered = audio_format.stats()
+    if delivered["clips"]:
+        formats = ", ".join(f"{name} {n}" for name, n in delivered["formats"].items())
+        encode = "-" if delivered["encode_p50"] is None else f"{delivered['encode_p50'] * 1000:.0f} ms"
+        print(f"== audio delivered: {delivered['clips']} clips, {delivered['bytes'] / delivered['clips'] / 1024:.1f} KB"
+              f" per clip; {formats}; encoder {delivered['encoder']}, encode p50 {encode}")
+        if not delivered["links_measured"]:
+            print(f"== client links: none measured (clips inline), every client on {audio_format.START_TIER}")
+    fallbacks = ", ".join(f"{name} {n}" for name, n in tails["fallbacks"].items()) or "none"
+    print(f"== canned fallbacks: {fallbacks}")
+    for s in summaries:
+        print(f"== {s['app']} slowest turn {s['interactive_wall_max'] * 1000:.0f} ms"
+              f" (turn budget {deadlines.TURN_BUDGETS[s['app']] * 1000:.0f} ms)")
+    if args.backend == "local":
+        import metrics
+
+        c = metrics.counters
+        print(f"== local engines: stt {c['stt_local']} answered, {c['stt_local_fallback']} fell back; "
+              f"tts {c['tts_local']} answered, {c['tts_local_fallback']} fell back")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"profile": args.profile, "summaries": summaries, "pool": pool, "turns": rows}, f, indent=2)
+    # A prompt over its token budget is a regression
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Process-wide store for finished audio clips, shared by every session.
+
+Sessions used to keep their own copy of each reply's audio in
+session_state and send it inline over the websocket, so ten tablets
+hearing the same celebration meant ten copies in memory and ten uploads.
+Now each clip is stored once under the hash of its bytes and a session
+holds a Clip handle; the audio sidecar serves it at /clip/<key> with
+long-lived cache headers, so the browser fetches a repeat clip at most
+once.
+
+A clip stays in memory while any handle to it is alive. Handles release
+their reference when garbage-collected, which also covers sessions that
+simply go away. A finalizer can run in the middle of any allocation,
+including one made while this module holds its lock, so it only queues
+the release; queued releases are applied under the lock by the next
+put, get or stats. Unreferenced clips are kept as an LRU cache up to
+CLIP_STORE_BYTES.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict, deque
+
+# ---------------- CONFIG ----------------
+CLIP_STORE_BYTES = int(os.getenv("CLIP_STORE_BYTES", str(64 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_clips = OrderedDict()  # key -> [data, content_type, refs], least recently used first
+_total = 0
+_released = deque()  # keys whose handles were collected; append is atomic
+
+# ---------------- STORE ----------------
+class Clip:
+    """A session's reference to a stored clip."""
+
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+
+    def __del__(self):
+        _released.append(self.key)  # Never take _lock here
+
+    def __repr__(self):
+        return f"Clip({self.key[:12]}, {self.size} bytes)"
+
+def sniff_type(data):
+    """Audio MIME type from the first bytes; MP3 unless it says otherwise."""
+    if data[:4] == b"RIFF":
+        return "audio/wav"
+    if data[:4] == b"OggS":
+        return "audio/ogg"
+    return "audio/mpeg"
+
+def put(data, content_type=None):
+    """Store data (once) and return a new Clip handle to it."""
+    global _total
+    content_type = content_type or sniff_type(data)
+    key = hashlib.sha256(data).hexdigest()[:32]
+    with _lock:
+        _drain()
+        entry = _clips.get(key)
+        if entry is None:
+            _clips[key] = [data, content_type, 1]
+            _total += len(data)
+            _evict()
+        else:
+            entry[2] += 1
+            _clips.move_to_end(key)
+    return Clip(key, len(data))
+
+def get(key):
+    """(data, content_type) for a key, or None if it is not stored."""
+    with _lock:
+        _drain()
+        entry = _clips.get(key)
+        if entry is None:
+            return None
+        _clips.move_to_end(key)
+        return entry[0], entry[1]
+
+def _drain():
+    """Apply queued releases. Caller holds _lock."""
+    while _released:
+        entry = _clips.get(_released.popleft())
+        if entry is not None:
+            entry[2] -= 1
+
+def _evict():
+    """Drop unreferenced clips, oldest first, until under budget. Caller holds _lock."""
+    global _total
+    if _total <= CLIP_STORE_BYTES:
+        return
+    for key in [key for key, entry in _clips.items() if entry[2] <= 0]:
+        _total -= len(_clips.pop(key)[0])
+        if _total <= CLIP_STORE_BYTES:
+            return
+
+def stats():
+    with _lock:
+        _drain()
+        _evict()
+        return {
+            "clips": len(_clips),
+            "bytes": _total,
+            "referenced": sum(1 for entry in _clips.values() if entry[2] > 0),
+        }
@@ -0,0 +1,173 @@
+"""Spoken replies spliced together from cached pieces.
+
+A reply used to reach TTS as one string: a random filler, the reply, and
+newlines meant as pauses (which sanitize_text flattened to spaces). Every
+such string was new, so the TTS cache almost never hit and each call paid
+for the filler again.
+
+Here a reply is a plan of segments, ("say", phrase) or ("pause", ms).
+Each phrase is synthesized on its own as raw 16-bit PCM (fillers and
+canned lines come pre-rendered from the audio pack), so a sentence said
+twice is synthesized once. Pauses are exact lengths of silence made
+locally, and the pieces are joined sample by sample into one WAV: no
+decoding, no re-encoding, and only the new sentences go to TTS.
+"""
+import array
+import io
+import os
+import sys
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import metrics
+import tts
+from phrases import sanitize_text, sentences
+
+# ---------------- CONFIG ----------------
+SAMPLE_RATE = 24000  # OpenAI's pcm format: 24 kHz, 16-bit, mono, little-endian
+SAMPLE_WIDTH = 2
+PHRASE_FORMAT = "pcm"
+FILLER_PAUSE_MS = 350
+SENTENCE_PAUSE_MS = 600
+WORD_PAUSE_MS = 450  # slow_opening's word-by-word pacing
+COMPOSE_WORKERS = int(os.getenv("COMPOSE_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=COMPOSE_WORKERS, thread_name_prefix="compose")
+
+# ---------------- PLANS ----------------
+def reply(text, filler=None):
+    """Segments for a reply: the filler, then each sentence, with pauses."""
+    segments = []
+    if filler:
+        segments += [("say", filler), ("pause", FILLER_PAUSE_MS)]
+    for sentence in sentences(text):
+        if segments and segments[-1][0] == "say":
+            segments.append(("pause", SENTENCE_PAUSE_MS))
+        segments.append(("say", sentence))
+    return segments
+
+def words(text):
+    """Segments for an opening line said word by word."""
+    segments = []
+    for word in text.split():
+        if segments:
+            segments.append(("pause", WORD_PAUSE_MS))
+        segments.append(("say", word))
+    return segments
+
+def phrases_of(segments):
+    """The distinct phrases a plan says, sanitized as TTS sees them."""
+    said = (sanitize_text(value) for kind, value in segments if kind == "say")
+    return list(dict.fromkeys(phrase for phrase in said if phrase))
+
+# ---------------- SAMPLES ----------------
+def _samples(audio):
+    """(rate, 16-bit mono little-endian frames) from raw pcm or a WAV."""
+    if audio[:4] != b"RIFF":
+        return SAMPLE_RATE, bytes(audio)
+    with wave.open(io.BytesIO(audio), "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width != SAMPLE_WIDTH:
+        raise ValueError(f"cannot splice {width * 8}-bit audio")
+    if channels > 1:
+        samples = array.array("h", raw)[::channels]
+        raw = samples.tobytes()
+    return rate, raw
+
+def resample(raw, rate, to_rate):
+    """Linear-interpolated 16-bit frames at to_rate."""
+    samples = array.array("h", raw)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if not samples:
+        return b""
+    n = max(1, len(samples) * to_rate // rate)
+    step = (len(samples) - 1) / max(1, n - 1)
+    out = array.array("h", bytes(2 * n))
+    for i in range(n):
+        pos = i * step
+        j = int(pos)
+        nxt = samples[min(j + 1, len(samples) - 1)]
+        out[i] = int(samples[j] + (nxt - samples[j]) * (pos - j))
+    if sys.byteorder == "big":
+        out.byteswap()
+    return out.tobytes()
+
+def silence(ms, rate=SAMPLE_RATE):
+    """ms of digital silence as 16-bit frames."""
+    return bytes(rate * ms // 1000 * SAMPLE_WIDTH)
+
+def _join(segments, pieces):
+    """One WAV of the plan, from {phrase: (rate, frames)} for its phrases.
+
+    Frames are copied as they are; only a phrase at a different rate from
+    the rest (a local-voice piece among API ones) is resampled.
+    """
+    rates = [rate for rate, _ in pieces.values()]
+    rate = max(set(rates), key=rates.count) if rates else SAMPLE_RATE
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(SAMPLE_WIDTH)
+        w.setframerate(rate)
+        for kind, value in segments:
+            if kind == "pause":
+                w.writeframes(silence(value, rate))
+                continue
+            piece = pieces.get(sanitize_text(value))
+            if piece is None:
+                continue
+            piece_rate, frames = piece
+            w.writeframes(frames if piece_rate == rate else resample(frames, piece_rate, rate))
+    return out.getvalue()
+
+# ---------------- RENDERING ----------------
+def lookup(segments):
+    """The plan's WAV if every phrase is pre-rendered or cached, else None.
+    Never calls out, so canned fallbacks can use it."""
+    pieces = {}
+    for phrase in phrases_of(segments):
+        audio = tts.lookup(phrase, fmt=PHRASE_FORMAT)
+        if not audio:
+            return None
+        pieces[phrase] = _samples(audio)
+    return _join(segments, pieces)
+
+def _phrase(client, phrase, deadline):
+    audio = tts.lookup(phrase, fmt=PHRASE_FORMAT)
+    if audio:
+        metrics.inc("compose_phrases_cached")
+    else:
+        metrics.inc("compose_phrases_synthesized")
+        metrics.inc("compose_tts_chars", len(phrase))
+        audio = tts.synthesize(client, phrase, deadline=deadline, fmt=PHRASE_FORMAT)
+    return _samples(audio)
+
+def render(client, segments, deadline=None):
+    """The plan as one WAV. Phrases missing from the pack and the cache
+    are synthesized in parallel, each under the deadline and queued with
+    the caller's upstream priority. Raises like tts.synthesize."""
+    phrases = phrases_of(segments)
+    if not phrases:
+        return None
+    futures = {
+        phrase: _executor.submit(copy_context().run, _phrase, client, phrase, deadline)
+        for phrase in phrases
+    }
+    pieces = {phrase: future.result() for phrase, future in futures.items()}
+    metrics.inc("compose_clips")
+    return _join(segments, pieces)
+
+# ---------------- REPORTING ----------------
+def stats():
+    """Composed clips, phrases served from pack or cache vs synthesized,
+    and characters sent to TTS."""
+    counters = dict(metrics.counters)
+    return {
+        "clips": counters.get("compose_clips", 0),
+        "cached": counters.get("compose_phrases_cached", 0),
+        "synthesized": counters.get("compose_phrases_synthesized", 0),
+        "tts_chars": counters.get("compose_tts_chars", 0),
+    }
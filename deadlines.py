@@ -0,0 +1,178 @@
+"""Latency budgets for upstream calls and for whole turns.
+
+Every chat, speech and transcription call runs under its stage's budget.
+If it has not answered by the stage's recent p95, an identical hedge
+request goes out and whichever answers first wins; the loser is left to
+finish on its own and is ignored. Callers that count requests in flight
+(upstream's limiter) are told when each attempt is done, not when call
+returns, and can skip the hedge when they have no room for it.
+
+Each turn also carries a Deadline. Before a stage starts, the turn checks
+that enough of it is left for that stage's usual tail; if not, or if a
+call runs out the clock, the app says a canned line with pre-rendered
+audio instead of waiting. So a turn takes at most its budget, whatever
+the upstream tail does. Hedges, timeouts and fallbacks are all counted.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+# ---------------- CONFIG ----------------
+# Seconds one call may take, hedge included
+STAGE_BUDGETS = {
+    "chat": float(os.getenv("CHAT_BUDGET", "4.0")),
+    "speech": float(os.getenv("SPEECH_BUDGET", "5.0")),
+    "transcription": float(os.getenv("TRANSCRIPTION_BUDGET", "5.0")),
+}
+# Seconds from the child's tap to Sarah's reply, per app
+TURN_BUDGETS = {
+    "bubbles": float(os.getenv("BUBBLES_TURN_BUDGET", "6.0")),
+    "speech": float(os.getenv("SPEECH_TURN_BUDGET", "8.0")),
+}
+HEDGING = os.getenv("HEDGING", "1") == "1"
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20  # until a stage has this many calls, hedge at half its budget
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "32"))
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+class DeadlineExceeded(TimeoutError):
+    """A call or turn ran out of its budget."""
+
+# ---------------- DEADLINES ----------------
+def expected(stage):
+    """Seconds a stage's calls usually finish within: their recent p95."""
+    p95 = metrics.quantile(f"{stage}_call", HEDGE_QUANTILE, min_count=HEDGE_MIN_SAMPLES)
+    return p95 if p95 is not None else STAGE_BUDGETS[stage] / 2
+
+class Deadline:
+    """The time left for one turn."""
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def allows(self, stage):
+        """Is there time for a stage's call to finish as it usually does?"""
+        return self.remaining() >= expected(stage)
+
+def fell_back(name):
+    """Count one canned reply (or canned part of one) served under `name`."""
+    metrics.inc(f"fallback_{name}")
+    log.info("Fell back to canned %s", name.replace("_", " "))
+
+# ---------------- CALLS ----------------
+def _when_settled(futures, callback):
+    """Call callback once every future is done (now, if they all are)."""
+    left = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            left[0] -= 1
+            last = not left[0]
+        if last:
+            callback()
+
+    if not futures:
+        callback()
+    for future in futures:
+        future.add_done_callback(done)
+
+def _hedge(stage, fn, args, kwargs, spare):
+    """Send the hedge if spare has room for it; its future, or None."""
+    freed = None
+    if spare is not None:
+        freed = spare()
+        if freed is None:
+            metrics.inc(f"hedge_skipped_{stage}")
+            return None
+    metrics.inc(f"hedged_{stage}")
+    try:
+        hedge = _executor.submit(fn, *args, **kwargs)
+    except BaseException:
+        if freed is not None:
+            freed()
+        raise
+    if freed is not None:
+        _when_settled([hedge], freed)
+    return hedge
+
+def call(stage, fn, *args, deadline=None, settled=None, spare=None, **kwargs):
+    """fn(*args, **kwargs) within the stage's budget (and the turn's
+    deadline, if given), hedged once it runs past the stage's p95.
+
+    Returns the first successful result. Raises DeadlineExceeded when
+    the time runs out, or the last error when every attempt failed.
+    settled, if given, is called once the first attempt has finished,
+    which may be after this returns or raises. spare, if given, is asked
+    before the hedge goes out: it returns a function to call once the
+    hedge has finished, or None to skip the hedge.
+    """
+    budget = STAGE_BUDGETS[stage]
+    if deadline is not None:
+        budget = min(budget, deadline.remaining())
+    start = time.perf_counter()
+    attempts = []
+    try:
+        first = _executor.submit(fn, *args, **kwargs)
+        attempts.append(first)
+        pending = {first}
+
+        hedge_at = expected(stage)
+        if HEDGING and hedge_at < budget:
+            done, _ = wait(pending, timeout=hedge_at)
+            if not done:
+                hedge = _hedge(stage, fn, args, kwargs, spare)
+                if hedge is not None:
+                    attempts.append(hedge)
+                    pending.add(hedge)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, budget - (time.perf_counter() - start)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    metrics.observe(f"{stage}_call", time.perf_counter() - start)
+                    if future is not first:
+                        metrics.inc(f"hedge_won_{stage}")
+                    return future.result()
+                error = future.exception()
+        if not pending and error is not None:
+            raise error
+
+        metrics.observe(f"{stage}_call", time.perf_counter() - start)
+        metrics.inc(f"deadline_{stage}")
+        raise DeadlineExceeded(f"{stage} took over {budget:.1f}s")
+    finally:
+        if settled is not None:
+            _when_settled(attempts[:1], settled)
+
+# ---------------- REPORTING ----------------
+def stats():
+    """Hedges sent, won and skipped, timeouts per stage, and fallbacks by name."""
+    counters = dict(metrics.counters)
+    return {
+        "stages": {
+            stage: {
+                "hedged": counters.get(f"hedged_{stage}", 0),
+                "hedge_won": counters.get(f"hedge_won_{stage}", 0),
+                "hedge_skipped": counters.get(f"hedge_skipped_{stage}", 0),
+                "timed_out": counters.get(f"deadline_{stage}", 0),
+            }
+            for stage in STAGE_BUDGETS
+        },
+        "fallbacks": {name[len("fallback_"):]: n for name, n in sorted(counters.items())
+                      if name.startswith("fallback_")},
+    }
@@ -0,0 +1,209 @@
+"""Load test: how many children can one Streamlit process keep up with?
+
+Runs N full sessions at once (bench.py's sessions, with think time
+between taps) against the mock OpenAI, stepping N up until turn latency
+degrades. Each level reports process CPU, RSS per session, the script
+rerun latency distribution and per-turn wall time.
+
+    python loadtest.py --app bubbles --levels 1,2,4,8,16 --think 3
+    python loadtest.py --app speech --profile slow --json load.json
+
+Sessions run through AppTest, which executes the app script the way the
+server does but without the websocket layer, so treat the knee as an
+upper bound for a real deployment.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+
+import bench
+from mock_openai import PROFILES, MockOpenAI
+
+# ---------------- CONFIG ----------------
+KNEE_FACTOR = 2.0  # p95 turn latency this many times the 1-session level counts as degraded
+
+# ---------------- HELPERS ----------------
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak, not current, where /proc is missing (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+def share_app_test_globals():
+    """Let AppTest sessions overlap.
+
+    Around every run AppTest installs a mock Runtime, swaps st.secrets and
+    patches a config option, then puts them back, so one session finishing
+    pulls the runtime (or the API key) out from under another. Install
+    them once for the whole process instead, as the real server does.
+    Likewise share one compiled-script cache: AppTest compiles the script
+    afresh on every run, and concurrent compiles can fail in CPython 3.11.
+    """
+    import contextlib
+    import types
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = app_test.MediaFileManager(app_test.MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = app_test.DataframeSourceManager()
+    runtime.cache_storage_manager = app_test.MemoryCacheStorageManager()
+    registry = app_test.BidiComponentManager()
+    registry.discover_and_register_components(start_file_watching=False)
+    runtime.bidi_component_registry = registry
+    Runtime._instance = runtime
+    config.set_option("global.appTest", True)
+    secrets = Secrets()
+    secrets._secrets = {"OPENAI_API_KEY": os.environ["OPENAI_API_KEY"]}
+    st.secrets = secrets
+
+    # AppTest's own swaps now land on a stand-in
+    app_test.Runtime = types.SimpleNamespace(_instance=None)
+    app_test.patch_config_options = lambda options: contextlib.nullcontext()
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+def run_level(app, mock, n, think_time):
+    """Run n sessions at once; return the level's measurements."""
+    import metrics
+    import upstream
+
+    metrics.reset()
+    runner = bench.RUNNERS[app]
+    sessions, errors = [], []
+    lock = threading.Lock()
+
+    def one():
+        try:
+            session = runner(mock, think_time=think_time)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+            return
+        with lock:
+            sessions.append(session)
+
+    rss_before = rss_bytes()
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=one, name=f"child-{i}") for i in range(n)]
+    for thread in threads:
+        thread.start()
+    # Sample memory while all sessions are live, not after they finish
+    rss_peak = rss_before
+    while any(thread.is_alive() for thread in threads):
+        rss_peak = max(rss_peak, rss_bytes())
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_before
+
+    walls = [t["wall"] for s in sessions for t in s.turns if t["kind"] != "load"]
+    rerun = metrics.snapshot().get("rerun", {})
+    return {
+        "sessions": n,
+        "completed": len(sessions),
+        "errors": errors,
+        "elapsed": elapsed,
+        "cpu_cores": cpu / elapsed if elapsed else 0.0,
+        "rss_mb": rss_peak / 2**20,
+        "rss_mb_per_session": max(0, rss_peak - rss_before) / 2**20 / n,
+        "turn_p50": statistics.median(walls) if walls else 0.0,
+        "turn_p95": bench.pct(walls, 0.95),
+        "turn_max": max(walls, default=0.0),
+        "rerun_p50": rerun.get("p50", 0.0),
+        "rerun_p95": rerun.get("p95", 0.0),
+        "rerun_p99": rerun.get("p99", 0.0),
+        "reruns": rerun.get("count", 0),
+        "upstream": upstream.stats(),
+    }
+
+def find_knee(levels):
+    """Largest session count whose p95 turn stays within KNEE_FACTOR of one session's."""
+    if not levels:
+        return None
+    baseline = levels[0]["turn_p95"]
+    good = None
+    for level in levels:
+        if level["errors"] or level["turn_p95"] > KNEE_FACTOR * baseline:
+            break
+        good = level["sessions"]
+    return good
+
+def print_levels(app, levels, knee):
+    print(f"\n== {app}")
+    print(" sessions   cpu  rss MB  MB/sess   turn p50   turn p95   rerun p50   rerun p95   rerun p99  errors")
+    for lv in levels:
+        print(f"{lv['sessions']:9d} {lv['cpu_cores']:5.2f} {lv['rss_mb']:7.0f} {lv['rss_mb_per_session']:8.1f}"
+              f" {lv['turn_p50'] * 1000:8.0f}ms {lv['turn_p95'] * 1000:8.0f}ms"
+              f" {lv['rerun_p50'] * 1000:9.0f}ms {lv['rerun_p95'] * 1000:9.0f}ms {lv['rerun_p99'] * 1000:9.0f}ms"
+              f" {len(lv['errors']):7d}")
+    for lv in levels:
+        for endpoint, s in lv["upstream"].items():
+            if s["requests"] or s["merged"]:
+                print(f"{lv['sessions']:9d}  {bench.format_upstream(endpoint, s)}")
+    if knee is None:
+        print("  degraded from the first level")
+    elif knee == levels[-1]["sessions"]:
+        print(f"  no knee up to {knee} sessions; try higher --levels")
+    else:
+        print(f"  p95 turn latency stays within {KNEE_FACTOR:g}x of one session up to {knee} sessions")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app", choices=["bubbles", "speech", "both"], default="bubbles")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="typical")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="comma-separated session counts")
+    parser.add_argument("--think", type=float, default=3.0, help="mean seconds between taps")
+    parser.add_argument("--stop-at-knee", action="store_true", help="skip levels past the first degraded one")
+    parser.add_argument("--json", help="write all levels to this file")
+    args = parser.parse_args(argv)
+
+    mock = MockOpenAI(args.profile).start()
+    bench.setup_environment(mock, cold=True)
+    bench.record_media()
+    share_app_test_globals()
+    os.chdir(bench.APP_DIR)
+
+    counts = sorted({int(n) for n in args.levels.split(",")})
+    apps = list(bench.RUNNERS) if args.app == "both" else [args.app]
+    results = {}
+    for app in apps:
+        # Warm imports, caches and the sidecar so level 1 is not a cold start
+        bench.RUNNERS[app](mock)
+        levels = []
+        for n in counts:
+            levels.append(run_level(app, mock, n, args.think))
+            print(f"  {app}: {n} sessions done in {levels[-1]['elapsed']:.0f}s", file=sys.stderr)
+            if args.stop_at_knee and find_knee(levels) != n:
+                break
+        results[app] = {"levels": levels, "knee": find_knee(levels)}
+    mock.stop()
+
+    for app, result in results.items():
+        print_levels(app, result["levels"], result["knee"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"profile": args.profile, "think": args.think, "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""In-process, CPU-only speech engines.
+
+Most of what My says is one word ("Am", "Nani", "mommy"), and most of
+what Sarah says is short. Both fit small local models that answer in
+tens of milliseconds, with no upload and no WAN round trip:
+
+- transcription: Vosk, restricted to the app's vocabulary, with a
+  per-word confidence so callers can fall back to Whisper when unsure
+- synthesis: Piper, returning 16-bit WAV
+
+Both are optional. pip install vosk / piper-tts and point VOSK_MODEL_PATH
+and PIPER_MODEL_PATH at downloaded models; without them the engines
+report themselves unavailable and callers use the remote API.
+"""
+import importlib.util
+import io
+import json
+import logging
+import os
+import threading
+import wave
+
+from relationships import ALIASES, SPOKEN_ALIASES
+
+# ---------------- CONFIG ----------------
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk-model-small-en-us-0.15")
+PIPER_MODEL_PATH = os.getenv("PIPER_MODEL_PATH", "models/en_US-amy-medium.onnx")
+
+# What the recognizer may hear; anything else comes back as [unk]
+VOCABULARY = sorted(set(ALIASES) | set(SPOKEN_ALIASES) | {
+    "yes", "no", "i", "don't", "know", "that's", "this", "is", "my", "it's", "and", "me",
+})
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stt_model = None
+_tts_voice = None
+
+# ---------------- LOADING ----------------
+def _load(current, module, path, open_model):
+    """Load a model once per process. False means unavailable for good."""
+    if current is not None:
+        return current
+    if importlib.util.find_spec(module) is None or not os.path.exists(path):
+        return False
+    try:
+        return open_model(path)
+    except Exception as e:
+        log.warning("Local %s model at %s failed to load: %s", module, path, e)
+        return False
+
+def _vosk():
+    global _stt_model
+    with _lock:
+        def open_model(path):
+            import vosk
+
+            vosk.SetLogLevel(-1)
+            return vosk.Model(path)
+
+        _stt_model = _load(_stt_model, "vosk", VOSK_MODEL_PATH, open_model)
+        return _stt_model
+
+def _piper():
+    global _tts_voice
+    with _lock:
+        def open_model(path):
+            from piper import PiperVoice
+
+            return PiperVoice.load(path)
+
+        _tts_voice = _load(_tts_voice, "piper", PIPER_MODEL_PATH, open_model)
+        return _tts_voice
+
+def stt_available():
+    return bool(_vosk())
+
+def tts_available():
+    return bool(_piper())
+
+# ---------------- ENGINES ----------------
+def transcribe(audio_bytes):
+    """(text, confidence) for 16-bit mono WAV bytes, or None if the local
+    engine cannot take this input.
+
+    Confidence is the lowest word confidence, and 0.0 when nothing in the
+    vocabulary was heard.
+    """
+    model = _vosk()
+    if not model:
+        return None
+    try:
+        with wave.open(io.BytesIO(audio_bytes), "rb") as w:
+            if w.getnchannels() != 1 or w.getsampwidth() != 2:
+                return None
+            rate = w.getframerate()
+            frames = w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    import vosk
+
+    recognizer = vosk.KaldiRecognizer(model, rate, json.dumps(VOCABULARY + ["[unk]"]))
+    recognizer.SetWords(True)
+    recognizer.AcceptWaveform(frames)
+    result = json.loads(recognizer.FinalResult())
+    words = [w for w in result.get("result", []) if w.get("word") != "[unk]"]
+    if not words or len(words) < len(result.get("result", [])):
+        return result.get("text", "").replace("[unk]", "").strip(), 0.0
+    return result["text"], min(w.get("conf", 0.0) for w in words)
+
+def synthesize(text, speed=1.0):
+    """16-bit WAV bytes for text, or None if no local voice is installed."""
+    voice = _piper()
+    if not voice:
+        return None
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        if hasattr(voice, "synthesize_wav"):
+            # piper-tts >= 1.3
+            from piper import SynthesisConfig
+
+            voice.synthesize_wav(text, w, syn_config=SynthesisConfig(length_scale=1.0 / speed))
+        else:
+            voice.synthesize(text, w, length_scale=1.0 / speed)
+    return out.getvalue()
@@ -0,0 +1,58 @@
+"""Photo manifest and system prompt, parsed once per process.
+
+Everything the apps derive from a photo's description is computed at
+load time, so a rerun is a dict lookup. Files are reloaded when their
+mtime or size changes; the stat itself is throttled to CHECK_INTERVAL.
+"""
+import json
+import os
+import threading
+import time
+
+from relationships import extract_relationships
+
+# ---------------- CONFIG ----------------
+DATA_PATH = "data/image_data.json"
+PROMPT_PATH = "system_prompt.txt"
+ASSETS_DIR = "assets"
+CHECK_INTERVAL = 5.0  # seconds between change checks
+
+_lock = threading.Lock()
+_entries = {}  # path -> [stamp, checked_at, value]
+
+# ---------------- HELPERS ----------------
+def _cached(path, parse):
+    """Parsed contents of path, re-parsed only when the file changes."""
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(path)
+        if entry and now - entry[1] < CHECK_INTERVAL:
+            return entry[2]
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if entry and entry[0] == stamp:
+            entry[1] = now
+            return entry[2]
+        with open(path) as f:
+            value = parse(f.read())
+        _entries[path] = [stamp, now, value]
+        return value
+
+def _parse_photos(raw):
+    photos = []
+    for img in json.loads(raw):
+        path = os.path.join(ASSETS_DIR, img["file"])
+        photos.append({
+            **img,
+            "path": path,
+            "exists": os.path.exists(path),
+            "people": extract_relationships(img["description"]),
+        })
+    return tuple(photos)
+
+def photos(path=DATA_PATH):
+    """All photos with derived fields. Shared across sessions: don't mutate."""
+    return _cached(path, _parse_photos)
+
+def system_prompt(path=PROMPT_PATH):
+    return _cached(path, str)
@@ -0,0 +1,174 @@
+"""Per-stage latency metrics, cheap enough to leave on.
+
+Every turn records timing spans (transcription, llm, tts, image, rerun)
+and sizes (audio bytes). Each name keeps a rolling window of recent
+values for p50/p95/p99, finished turns are appended to a JSONL log, and
+render() produces Prometheus text, served at /metrics on its own
+listener. That listener has no authentication, so it binds to
+METRICS_HOST (loopback by default): scrape from the same machine, or set
+METRICS_HOST to an interface only the scraper can reach.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------------- CONFIG ----------------
+METRICS_LOG = os.getenv("METRICS_LOG", ".cache/metrics.jsonl")
+WINDOW = 1000  # recent samples kept per metric
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8598"))
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=WINDOW))
+_totals = defaultdict(lambda: [0, 0.0])  # name -> [count, sum], over all time
+counters = defaultdict(int)
+_log_file = None
+_server = None
+
+# ---------------- RECORDING ----------------
+def observe(name, value):
+    with _lock:
+        _samples[name].append(value)
+        total = _totals[name]
+        total[0] += 1
+        total[1] += value
+
+def inc(name, n=1):
+    with _lock:
+        counters[name] += n
+
+def reset():
+    """Forget all samples and counters, e.g. between load-test levels."""
+    with _lock:
+        _samples.clear()
+        _totals.clear()
+        counters.clear()
+
+@contextmanager
+def span(name):
+    """Time a block into the `name` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+class Turn:
+    """Spans and sizes for one turn, written to the log when finished."""
+
+    def __init__(self, app, session_id):
+        self.app = app
+        self.session_id = session_id
+        self.fields = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.fields[name] = self.fields.get(name, 0.0) + elapsed
+            observe(name, elapsed)
+
+    def record(self, name, value):
+        self.fields[name] = value
+        observe(name, value)
+
+    def finish(self):
+        _write({"ts": time.time(), "app": self.app, "session": self.session_id, **self.fields})
+
+def _write(entry):
+    global _log_file
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+    with _lock:
+        try:
+            if _log_file is None:
+                os.makedirs(os.path.dirname(METRICS_LOG) or ".", exist_ok=True)
+                _log_file = open(METRICS_LOG, "a", buffering=1)
+            _log_file.write(line)
+        except OSError:
+            pass
+
+# ---------------- EXPORT ----------------
+def _quantile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def quantile(name, q, min_count=1):
+    """q-quantile of one metric's recent samples, or None with fewer than min_count."""
+    with _lock:
+        values = sorted(_samples[name]) if name in _samples else []
+    if len(values) < max(1, min_count):
+        return None
+    return _quantile(values, q)
+
+def snapshot():
+    """{name: {"p50": .., "p95": .., "p99": .., "count": .., "sum": ..}}"""
+    with _lock:
+        windows = {name: sorted(values) for name, values in _samples.items()}
+        totals = {name: tuple(total) for name, total in _totals.items()}
+    result = {}
+    for name, values in windows.items():
+        if not values:
+            continue
+        stats = {f"p{int(q * 100)}": _quantile(values, q) for q in QUANTILES}
+        stats["count"], stats["sum"] = totals[name]
+        result[name] = stats
+    return result
+
+def render():
+    """Prometheus text exposition of all metrics."""
+    lines = ["# TYPE sarah_turn summary"]
+    for name, stats in sorted(snapshot().items()):
+        for q in QUANTILES:
+            lines.append(f'sarah_turn{{metric="{name}",quantile="{q}"}} {stats[f"p{int(q * 100)}"]:.6g}')
+        lines.append(f'sarah_turn_count{{metric="{name}"}} {stats["count"]}')
+        lines.append(f'sarah_turn_sum{{metric="{name}"}} {stats["sum"]:.6g}')
+    lines.append("# TYPE sarah_events counter")
+    with _lock:
+        events = sorted(counters.items())
+    for name, value in events:
+        lines.append(f'sarah_events{{event="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+# ---------------- SERVING ----------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def ensure_serving():
+    """Serve /metrics on METRICS_HOST:METRICS_PORT, once per process."""
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server or None
+        try:
+            _server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _Handler)
+        except OSError as e:
+            # Usually the other app already holds the port
+            log.warning("Metrics not served on %s:%s: %s", METRICS_HOST, METRICS_PORT, e)
+            _server = False
+            return None
+        _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
@@ -0,0 +1,268 @@
+"""Local stand-in for the OpenAI endpoints the apps use.
+
+Serves chat completions (plain and streamed), speech (chunked) and
+transcriptions with configurable latency and payload sizes, and counts
+calls per endpoint. Used by bench.py; can also run on its own:
+
+    python mock_openai.py --profile typical --port 8700
+    OPENAI_BASE_URL=http://127.0.0.1:8700/v1 streamlit run app.py
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import wave
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------------- PROFILES ----------------
+# Seconds, except *_bytes. Latencies get +/- jitter (a fraction), and
+# tail_rate of calls take tail_factor times as long (a stalled backend).
+PROFILES = {
+    "instant": {
+        "chat_first_token": 0.0, "chat_per_token": 0.0,
+        "speech_first_byte": 0.0, "speech_per_char": 0.0, "speech_bytes_per_char": 400,
+        "stt_base": 0.0, "stt_per_mb": 0.0,
+        "jitter": 0.0,
+    },
+    "typical": {
+        "chat_first_token": 0.35, "chat_per_token": 0.012,
+        "speech_first_byte": 0.30, "speech_per_char": 0.008, "speech_bytes_per_char": 400,
+        "stt_base": 0.45, "stt_per_mb": 1.2,
+        "jitter": 0.25,
+    },
+    "flaky": {
+        "chat_first_token": 0.35, "chat_per_token": 0.012,
+        "speech_first_byte": 0.30, "speech_per_char": 0.008, "speech_bytes_per_char": 400,
+        "stt_base": 0.45, "stt_per_mb": 1.2,
+        "jitter": 0.25, "tail_rate": 0.08, "tail_factor": 12.0,
+    },
+    "slow": {
+        "chat_first_token": 1.2, "chat_per_token": 0.04,
+        "speech_first_byte": 0.9, "speech_per_char": 0.02, "speech_bytes_per_char": 400,
+        "stt_base": 1.5, "stt_per_mb": 4.0,
+        "jitter": 0.5,
+    },
+}
+
+# Audio size per format relative to speech_bytes_per_char (mp3): raw
+# 24 kHz 16-bit PCM is about three times OpenAI's mp3
+FORMAT_SIZE = {"mp3": 1.0, "opus": 0.5, "aac": 1.0, "flac": 2.0, "wav": 3.0, "pcm": 3.0}
+
+# Provider-side prompt caching as OpenAI documents it: prompts of at
+# least PROMPT_CACHE_MIN_TOKENS reuse the longest prefix shared with a
+# recent prompt, in PROMPT_CACHE_BLOCK-token steps. Set the minimum to 0
+# to see how much of a short prompt would be cacheable.
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("MOCK_PROMPT_CACHE_MIN_TOKENS", "1024"))
+PROMPT_CACHE_BLOCK = 128
+CHARS_PER_TOKEN = 4
+
+# Sampled like a real model at temperature > 0, so replies vary
+REPLIES = [
+    "Oooh! I see your brother! Who else do you see?",
+    "Hehe! Good looking! Who is that?",
+    "Mmm! So many smiles! Who else is here?",
+    "Yay! Look closer! Who do you see?",
+]
+WRAP_UP_REPLIES = [
+    "Yay! Great job! Let's see another photo!",
+    "Wow, so good! Let's see another photo!",
+]
+
+# ---------------- SERVER ----------------
+class MockOpenAI:
+    """Threaded mock server. Use .base_url as OPENAI_BASE_URL."""
+
+    def __init__(self, profile="typical", port=0, transcripts=("brother",), **overrides):
+        self.profile = {**PROFILES[profile], **overrides}
+        self.calls = Counter()
+        self.bytes_in = Counter()
+        self.bytes_out = Counter()
+        self.speech_chars = 0  # TTS input characters
+        self._transcripts = itertools.cycle(transcripts)
+        self._prompts = deque(maxlen=256)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _handler_for(self))
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_transcripts(self, transcripts):
+        with self._lock:
+            self._transcripts = itertools.cycle(transcripts)
+
+    def next_transcript(self):
+        with self._lock:
+            return next(self._transcripts)
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.calls), Counter(self.bytes_out)
+
+    def count(self, endpoint, bytes_in, bytes_out):
+        with self._lock:
+            self.calls[endpoint] += 1
+            self.bytes_in[endpoint] += bytes_in
+            self.bytes_out[endpoint] += bytes_out
+
+    def cached_tokens(self, prompt):
+        """Prompt-cache hit for prompt against recent ones, then remember it."""
+        with self._lock:
+            shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self._prompts), default=0)
+            self._prompts.append(prompt)
+        if len(prompt) // CHARS_PER_TOKEN < max(1, PROMPT_CACHE_MIN_TOKENS):
+            return 0
+        return shared // CHARS_PER_TOKEN // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK
+
+    def delay(self, seconds):
+        jitter = self.profile["jitter"]
+        if seconds > 0:
+            if random.random() < self.profile.get("tail_rate", 0.0):
+                seconds *= self.profile["tail_factor"]
+            time.sleep(seconds * random.uniform(1 - jitter, 1 + jitter))
+
+def _fake_audio(fmt, n_bytes):
+    """Audio-shaped bytes: real PCM/WAV framing where the format has one."""
+    if fmt == "pcm":
+        return bytes(n_bytes - n_bytes % 2)
+    if fmt == "wav":
+        out = io.BytesIO()
+        with wave.open(out, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(24000)
+            w.writeframes(bytes(n_bytes - n_bytes % 2))
+        return out.getvalue()
+    if fmt == "opus":
+        return b"OggS" + random.randbytes(n_bytes - 4)
+    return random.randbytes(n_bytes)
+
+def _handler_for(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = self.path.split("?", 1)[0]
+            if path.endswith("/chat/completions"):
+                self.chat(json.loads(body), len(body))
+            elif path.endswith("/audio/speech"):
+                self.speech(json.loads(body), len(body))
+            elif path.endswith("/audio/transcriptions"):
+                self.transcription(body)
+            else:
+                self.send_error(404)
+
+        def send_json(self, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return len(data)
+
+        def chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def chat(self, request, bytes_in):
+            prompt = json.dumps(request.get("messages", []))
+            text = random.choice(WRAP_UP_REPLIES if "PHASE: WRAPPING UP" in prompt else REPLIES)
+            words = text.split(" ")
+            prompt_tokens = len(prompt) // CHARS_PER_TOKEN
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words),
+                "prompt_tokens_details": {"cached_tokens": mock.cached_tokens(prompt)},
+            }
+            base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": request.get("model", "mock")}
+            mock.delay(mock.profile["chat_first_token"])
+            if not request.get("stream"):
+                mock.delay(mock.profile["chat_per_token"] * len(words))
+                sent = self.send_json({
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": usage,
+                })
+                mock.count("chat", bytes_in, sent)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            sent = 0
+            for i, word in enumerate(words):
+                piece = word if i == 0 else " " + word
+                event = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                data = b"data: " + json.dumps(event).encode("utf-8") + b"\n\n"
+                self.chunk(data)
+                sent += len(data)
+                mock.delay(mock.profile["chat_per_token"])
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+                self.chunk(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+            self.chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            mock.count("chat", bytes_in, sent)
+
+        def speech(self, request, bytes_in):
+            text = request.get("input", "")
+            fmt = request.get("response_format", "mp3")
+            audio = _fake_audio(fmt, max(64, int(len(text) * mock.profile["speech_bytes_per_char"]
+                                                 * FORMAT_SIZE.get(fmt, 1.0))))
+            mock.delay(mock.profile["speech_first_byte"])
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = [audio[i:i + 8192] for i in range(0, len(audio), 8192)]
+            for piece in pieces:
+                self.chunk(piece)
+                mock.delay(mock.profile["speech_per_char"] * len(text) / len(pieces))
+            self.wfile.write(b"0\r\n\r\n")
+            mock.count("speech", bytes_in, len(audio))
+            with mock._lock:
+                mock.speech_chars += len(text)
+
+        def transcription(self, body):
+            mb = len(body) / 1e6
+            mock.delay(mock.profile["stt_base"] + mock.profile["stt_per_mb"] * mb)
+            sent = self.send_json({"text": mock.next_transcript()})
+            mock.count("transcription", len(body), sent)
+
+    return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI server.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="typical")
+    parser.add_argument("--port", type=int, default=8700)
+    args = parser.parse_args()
+    server = MockOpenAI(args.profile, args.port).start()
+    print(f"Mock OpenAI ({args.profile}) at {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
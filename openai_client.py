@@ -0,0 +1,165 @@
+"""One OpenAI client per process, on a tuned keep-alive connection pool.
+
+Streamlit re-executes the app script on every rerun, so a client built at
+the top of the script meant a fresh connection pool (and a fresh TCP+TLS
+handshake) per click. get_client() builds it once and every rerun,
+session and worker thread shares it.
+
+Pool statistics go to metrics: connections opened vs reused, and
+handshake time (TCP connect through TLS). So do the prompt, cached and
+completion tokens of every chat call, checked against a per-prompt budget.
+"""
+import importlib.util
+import logging
+import operator
+import os
+import threading
+import time
+
+import httpx
+import openai
+
+import metrics
+
+# ---------------- CONFIG ----------------
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "16"))
+KEEPALIVE_EXPIRY = 120  # seconds an idle connection stays open
+HTTP2 = os.getenv("OPENAI_HTTP2") == "1" and importlib.util.find_spec("h2") is not None
+
+# Chat can run on any OpenAI-compatible server (llama.cpp, Ollama, vLLM)
+# while speech stays on OpenAI; pick per deployment
+CHAT_BASE_URL = os.getenv("CHAT_BASE_URL", "")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+
+# Per-endpoint budgets: connect quickly or give up, then allow for the
+# work itself (speech for slowed, pause-padded text is the longest)
+TIMEOUTS = {
+    "chat": httpx.Timeout(20.0, connect=5.0),
+    "speech": httpx.Timeout(30.0, connect=5.0),
+    "transcription": httpx.Timeout(30.0, connect=5.0),
+}
+
+# Prompt tokens one chat call may send, per prompt. Going over is logged
+# and counted as a prompt regression, not refused
+PROMPT_TOKEN_BUDGETS = {
+    "bubbles": int(os.getenv("BUBBLES_PROMPT_TOKEN_BUDGET", "180")),
+    "speech": int(os.getenv("SPEECH_PROMPT_TOKEN_BUDGET", "600")),
+}
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+
+# ---------------- TRACING ----------------
+class _ConnectionTrace:
+    """httpcore trace hook for one request: did it open a connection?"""
+
+    def __init__(self):
+        self.connect_started = None
+        self.handshake = None
+
+    def __call__(self, event, info):
+        if event == "connection.connect_tcp.started":
+            self.connect_started = time.perf_counter()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            if self.connect_started is not None:
+                self.handshake = time.perf_counter() - self.connect_started
+
+    def record(self):
+        if self.connect_started is None:
+            metrics.inc("http_connections_reused")
+        else:
+            metrics.inc("http_connections_opened")
+            if self.handshake is not None:
+                metrics.observe("http_handshake", self.handshake)
+
+class _TracingTransport(httpx.HTTPTransport):
+    def handle_request(self, request):
+        trace = _ConnectionTrace()
+        request.extensions["trace"] = trace
+        try:
+            return super().handle_request(request)
+        finally:
+            trace.record()
+
+# ---------------- CLIENT ----------------
+def get_client(api_key=None, base_url=None):
+    """The shared client for this API key and server, created on first use."""
+    with _lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            )
+            http_client = httpx.Client(
+                transport=_TracingTransport(limits=limits, http2=HTTP2),
+                timeout=TIMEOUTS["chat"],
+            )
+            client = openai.Client(api_key=api_key, base_url=base_url or None, http_client=http_client)
+            _clients[(api_key, base_url)] = client
+        return client
+
+def chat_client(api_key=None):
+    """The shared client for chat completions (CHAT_BASE_URL if set)."""
+    return get_client(api_key, CHAT_BASE_URL or None)
+
+def bounded(client, method, stage, deadline=None):
+    """client's method (e.g. "chat.completions.create") as one request that
+    ends with the turn: no SDK retries, and a timeout of the deadline's time
+    left when the request is sent. Without a deadline, the stage's TIMEOUTS.
+
+    A request that outlives its turn still holds an upstream slot, so a
+    stalled upstream would otherwise fill every slot for a minute or more.
+    """
+    if deadline is None:
+        create = operator.attrgetter(method)(client)
+        return lambda *args, **kwargs: create(*args, timeout=TIMEOUTS[stage], **kwargs)
+    create = operator.attrgetter(method)(client.with_options(max_retries=0))
+    return lambda *args, **kwargs: create(*args, timeout=deadline.remaining(), **kwargs)
+
+def pool_stats():
+    """Connections opened and reused so far, and handshake percentiles."""
+    handshake = metrics.snapshot().get("http_handshake", {})
+    return {
+        "opened": metrics.counters["http_connections_opened"],
+        "reused": metrics.counters["http_connections_reused"],
+        "handshake_p50": handshake.get("p50"),
+        "handshake_p95": handshake.get("p95"),
+    }
+
+# ---------------- USAGE ----------------
+def record_usage(name, usage):
+    """Account one chat call's tokens under the prompt's name and check
+    its budget. usage is the response's (None when the server sent none)."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    metrics.observe(f"{name}_prompt_tokens", usage.prompt_tokens)
+    metrics.observe(f"{name}_cached_tokens", cached)
+    metrics.observe(f"{name}_completion_tokens", usage.completion_tokens)
+    budget = PROMPT_TOKEN_BUDGETS.get(name)
+    if budget and usage.prompt_tokens > budget:
+        metrics.inc(f"{name}_over_token_budget")
+        log.warning("%s prompt is %d tokens, over its budget of %d", name, usage.prompt_tokens, budget)
+
+def usage_stats(name):
+    """Chat calls so far for a prompt, mean tokens per call and calls over budget."""
+    snapshot = metrics.snapshot()
+    calls = snapshot.get(f"{name}_prompt_tokens", {}).get("count", 0)
+
+    def mean(kind):
+        return snapshot.get(f"{name}_{kind}_tokens", {}).get("sum", 0) / calls if calls else 0.0
+
+    return {
+        "calls": calls,
+        "prompt": mean("prompt"),
+        "cached": mean("cached"),
+        "completion": mean("completion"),
+        "budget": PROMPT_TOKEN_BUDGETS.get(name),
+        "over_budget": metrics.counters[f"{name}_over_token_budget"],
+    }
@@ -0,0 +1,97 @@
+"""Resized, correctly oriented derivatives of the photos in assets/.
+
+Each photo is rendered once per content hash at a few fixed widths,
+kept on disk and in memory, and the apps show the smallest one that
+still fills the page. Pre-build them for a new photo set with:
+
+    python photos.py
+"""
+import functools
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageOps, features
+
+# ---------------- CONFIG ----------------
+CACHE_DIR = os.getenv("PHOTO_CACHE_DIR", ".cache/photos")
+WIDTHS = (480, 800, 960, 1280)
+QUALITY = 80
+USE_WEBP = features.check("webp")
+CHECK_INTERVAL = 5.0  # seconds between change checks
+
+_lock = threading.Lock()
+_digests = {}
+
+# ---------------- HELPERS ----------------
+def _digest(path):
+    """Content hash of a photo, recomputed only when the file changes.
+
+    The file is stat'ed at most once per CHECK_INTERVAL.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _digests.get(path)
+    if cached and now - cached[1] < CHECK_INTERVAL:
+        return cached[2]
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if cached and cached[0] == stamp:
+        digest = cached[2]
+    else:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+    with _lock:
+        _digests[path] = (stamp, now, digest)
+    return digest
+
+def _render(path, width):
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        out = io.BytesIO()
+        if USE_WEBP:
+            img.save(out, "WEBP", quality=QUALITY, method=4)
+        else:
+            img.save(out, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+@functools.lru_cache(maxsize=64)
+def _derivative(path, digest, width):
+    ext = "webp" if USE_WEBP else "jpg"
+    cached = os.path.join(CACHE_DIR, f"{digest}-{width}.{ext}")
+    try:
+        with open(cached, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    data = _render(path, width)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, cached)
+    return data
+
+def fit(path, width):
+    """Smallest derivative at least `width` pixels wide, as image bytes."""
+    size = next((w for w in WIDTHS if w >= width), WIDTHS[-1])
+    return _derivative(path, _digest(path), size)
+
+def build_all(data_path="data/image_data.json"):
+    with open(data_path) as f:
+        images = json.load(f)
+    for img in images:
+        path = os.path.join("assets", img["file"])
+        for width in WIDTHS:
+            size = len(fit(path, width))
+            print(f"{img['file']} @ {width}px: {size / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    build_all(*sys.argv[1:])
@@ -0,0 +1,56 @@
+import re
+
+# ---------------- CANNED LINES ----------------
+# Every fixed thing Sarah can say. Kept here so the audio pack builder
+# renders exactly what the apps speak.
+BUBBLE_OPENING = "Oooh, look at this photo! Who do you see?"
+SPEECH_OPENING = "Oooh, I see a photo! Who is this?"
+CELEBRATION = "Yay! All done! Great job My! You did so well! I'm so proud of you!"
+BUBBLE_TRY_AGAIN = "Mmm, good try! Who else do you see?"
+SPEECH_FALLBACK = "Mmm, tell me more!"
+SARAH_THINKING = "Mmm..."  # Shown, not spoken, while a reply is on its way
+
+BUBBLE_FILLERS = ["Mmm.", "Oooh.", "Hehe.", "Ahh.", "Yay."]
+SPEECH_FILLERS = ["Mmm.", "Oooh.", "Hehe.", "Ahh.", "Ooh."]
+
+# All possible relationship options (shown as bubbles)
+ALL_RELATIONSHIPS = ["Mom", "Dad", "Brother", "Sister", "Grandmom", "Granddad", "Cousin", "Aunt", "Uncle"]
+
+def bubble_correct(selection):
+    """Fallback line when a bubble pick is right."""
+    return f"Yay! You see {selection}! Who else?"
+
+# ---------------- SHAPING ----------------
+SENTENCE_END = re.compile(r'[.!?]')
+
+def split_sentences(text):
+    """Sentences of text, without their end punctuation."""
+    return [p.strip() for p in SENTENCE_END.split(text) if p.strip()]
+
+def sentences(text):
+    """Sentences of text, keeping their end punctuation."""
+    return [p.strip() for p in re.findall(r"[^.!?]+[.!?]*", text) if p.strip(" .!?")]
+
+def slow_text(text):
+    """Add pauses between sentences for TTS."""
+    if not text:
+        return ""
+    return ".\n\n\n".join(split_sentences(text)) + "."
+
+add_pauses = slow_text
+
+def slow_opening(text):
+    """Extra slow word-by-word pacing for opening lines."""
+    return "\n\n".join(text.split())
+
+def wrap_with(filler, text):
+    """Put a filler sound in front of a reply."""
+    return f"{filler}\n\n{text}"
+
+def sanitize_text(text):
+    """Clean text for TTS."""
+    if not text:
+        return ""
+    text = re.sub(r"[^\x00-\x7F]+", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
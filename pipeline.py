@@ -0,0 +1,123 @@
+"""Sentence-pipelined chat -> TTS.
+
+The chat completion is streamed and cut at sentence ends (the same rule
+add_pauses uses). Each finished sentence goes to TTS straight away, so
+synthesis of the first sentence overlaps generation of the rest. The
+clips are played back in order, either through a live audio stream or
+joined into one clip once all are done. With a turn deadline, the stream
+is cut off and each sentence's TTS call bounded once it runs out.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import audio_server
+import deadlines
+import tts
+import upstream
+from phrases import SENTENCE_END, add_pauses, split_sentences
+
+# ---------------- CONFIG ----------------
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+# ---------------- HELPERS ----------------
+def _play_in_order(segments, stream):
+    """Feed finished clips to the stream in sentence order."""
+    while True:
+        future = segments.get()
+        if future is None:
+            break
+        try:
+            audio = future.result()
+        except Exception as e:
+            log.warning("Pipelined TTS segment failed: %s", e)
+            continue
+        if audio:
+            stream.feed(bytes(audio))
+    stream.close()
+
+def speak_pipelined(client, messages, wrap_first, host=None, stream_audio=False, chat_client=None,
+                    on_usage=None, on_text=None, deadline=None, **chat_kwargs):
+    """Stream a chat reply and synthesize it sentence by sentence.
+
+    wrap_first shapes the first sentence (e.g. to add a filler). Returns
+    (reply_text, audio) where audio is a playable URL when stream_audio is
+    set and the audio sidecar is up, else the joined clip. chat_client, if given, serves the chat
+    completion instead of client; on_usage, if given, receives the
+    stream's token usage, and on_text the reply text as soon as the
+    stream ends, before its audio is done. Under deadline the reply is
+    cut short when time runs out, and sentences whose TTS cannot finish
+    in time are left out. Raises if the chat call fails (DeadlineExceeded
+    if it ran out of time) before any text arrives.
+    """
+    segments = queue.Queue()
+    stream = audio_server.AudioStream()
+    feeder = threading.Thread(target=_play_in_order, args=(segments, stream), daemon=True)
+    feeder.start()
+
+    first = True
+
+    def submit(sentence):
+        nonlocal first
+        shaped = add_pauses(sentence)
+        if first:
+            shaped = wrap_first(shaped)
+            first = False
+        # Remote MP3 only: its frames concatenate cleanly, local WAV clips do not
+        segments.put(_executor.submit(tts.synthesize, client, shaped, "remote", deadline=deadline))
+
+    reply = []
+    pending = ""
+    try:
+        if on_usage:
+            chat_kwargs["stream_options"] = {"include_usage": True}
+        chat = chat_client or client
+        if deadline is not None:
+            # No read may outlast the turn, and a retry would start after it
+            chat = chat.with_options(max_retries=0)
+            chat_kwargs["timeout"] = deadline.remaining()
+        # Not hedged or merged: a stream has one reader
+        response = upstream.call("chat", chat.chat.completions.create, hedged=False,
+                                 deadline=deadline, messages=messages, stream=True, **chat_kwargs)
+        for chunk in response:
+            if deadline is not None and not deadline.remaining():
+                response.close()
+                raise deadlines.DeadlineExceeded("chat stream ran past the turn's deadline")
+            if on_usage and chunk.usage:
+                on_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            reply.append(delta)
+            pending += delta
+            ends = list(SENTENCE_END.finditer(pending))
+            if ends:
+                cut = ends[-1].end()
+                for sentence in split_sentences(pending[:cut]):
+                    submit(sentence)
+                pending = pending[cut:]
+    except Exception as e:
+        if not reply:
+            segments.put(None)
+            if deadline is not None and not deadline.remaining():
+                raise deadlines.DeadlineExceeded("chat stream ran past the turn's deadline") from e
+            raise
+        log.warning("Chat stream broke off; speaking the partial reply")
+
+    for sentence in split_sentences(pending):
+        submit(sentence)
+    segments.put(None)
+
+    text = "".join(reply).strip()
+    if on_text and text:
+        on_text(text)
+    if stream_audio and audio_server.ensure_started():
+        return text, audio_server.url_for(audio_server.register(stream), host)
+    feeder.join()
+    return text, stream.content() or None
@@ -0,0 +1,102 @@
+"""One compiled matcher for relationship words.
+
+Descriptions and transcripts go through the same single-pass regex with
+word boundaries, its alternation factored as a trie. "mom" no longer
+matches inside "grandmom" and "am" no longer matches inside "camera".
+Every hit maps to a bubble label, except in phrases that name something
+else ("daddy long legs") and, for "am", in "I am" and questions ("where
+am I", "am I right").
+test_relationships.py checks it against data/relationship_corpus.json.
+"""
+import functools
+import re
+
+# ---------------- ALIASES ----------------
+# Words a photo description may use, mapped to bubble labels
+ALIASES = {
+    "brother": "Brother",
+    "mom": "Mom", "mother": "Mom", "mommy": "Mom", "mum": "Mom",
+    "dad": "Dad", "father": "Dad", "daddy": "Dad",
+    "grandmom": "Grandmom", "grandmother": "Grandmom", "grandma": "Grandmom", "granny": "Grandmom",
+    "granddad": "Granddad", "grandad": "Granddad", "grandfather": "Granddad", "grandpa": "Granddad",
+    "cousin": "Cousin",
+    "sister": "Sister",
+    "aunt": "Aunt", "auntie": "Aunt", "aunty": "Aunt",
+    "uncle": "Uncle",
+}
+
+# Extra words only My uses when talking (see system_prompt.txt)
+SPOKEN_ALIASES = {
+    "am": "Brother",
+    "nani": "Grandmom",
+    "mama": "Mom",
+    "papa": "Dad",
+}
+# Words that are not a name when the text before them ends like this
+NOT_AFTER = {
+    "am": re.compile(r"\b(?:i|what|where|who|how|why|when|which)\s+$"),  # "I am done", "where am I"
+}
+# ... or when the text after them starts like this
+NOT_BEFORE = {
+    "am": re.compile(r"\s+i\b"),  # "Am I right?"
+}
+
+# Phrases with an alias in them that are not people
+NOT_PEOPLE = ["daddy long legs", "daddy longlegs", "grandfather clock", "mother nature", "father christmas"]
+
+def _trie_pattern(words):
+    """Regex alternation factored as a trie, so each position is tried once
+    per shared prefix instead of once per word."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+def _compile(aliases):
+    return re.compile(r"\b(" + _trie_pattern(aliases) + r")s?\b")
+
+_WRITTEN = _compile(ALIASES)
+_SPOKEN_LABELS = {**ALIASES, **SPOKEN_ALIASES}
+_SPOKEN = _compile(_SPOKEN_LABELS)
+_NOT_PEOPLE = re.compile(r"\b(?:" + _trie_pattern(NOT_PEOPLE) + r")s?\b")
+
+# ---------------- MATCHING ----------------
+def find(text, spoken=False):
+    """Bubble labels named in text, in order of first mention."""
+    if not text:
+        return []
+    pattern = _SPOKEN if spoken else _WRITTEN
+    labels = _SPOKEN_LABELS if spoken else ALIASES
+    text = _NOT_PEOPLE.sub(" ", text.lower())
+    found = []
+    for match in pattern.finditer(text):
+        word = match.group(1)
+        if word in NOT_AFTER and NOT_AFTER[word].search(text, 0, match.start()):
+            continue
+        if word in NOT_BEFORE and NOT_BEFORE[word].match(text, match.end()):
+            continue
+        found.append(labels[word])
+    return list(dict.fromkeys(found))
+
+@functools.lru_cache(maxsize=256)
+def _find_cached(description):
+    return tuple(find(description))
+
+def extract_relationships(description):
+    """Relationships in a photo description, as bubble labels."""
+    return list(_find_cached(description))
+
+def check_success(transcript, people_in_photo):
+    """True if the transcript names anyone who is in the photo."""
+    return any(label in people_in_photo for label in find(transcript, spoken=True))
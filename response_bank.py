@@ -0,0 +1,258 @@
+"""Bank of pre-generated bubble-app replies.
+
+A bubble reply depends only on the photo, the phase, the bubble picked
+and whether it was right, and it is a few words of cheer. So replies are
+kept per (photo, phase, selection, is_correct) key, several variants
+each, and a click picks one at random. The LLM is only called when a
+key has fewer than MIN_VARIANTS; its reply joins the bank.
+
+Fill it offline, in parallel, before a session:
+
+    python response_bank.py --variants 4 --workers 8
+"""
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+
+# ---------------- CONFIG ----------------
+BANK_PATH = os.getenv("RESPONSE_BANK_PATH", "data/response_bank.json")
+MIN_VARIANTS = int(os.getenv("RESPONSE_BANK_MIN_VARIANTS", "3"))  # fewer than this counts as a miss
+MAX_VARIANTS = 8
+SAVE_INTERVAL = 30  # seconds between writes while the bank grows live
+
+_lock = threading.Lock()
+_bank = None
+_dirty = False
+_saved_at = 0.0
+
+# ---------------- PROMPT ----------------
+def turn_phase(selection, people_in_photo, turn, is_correct, ready_to_move):
+    """(phase, instruction) for one click."""
+    if turn == 1:
+        return "OPENING", "First turn! Be excited about the photo. Ask who they see."
+    if is_correct and not ready_to_move:
+        return "CELEBRATING", f"They correctly said {selection}! Celebrate big! Then ask 'Who else do you see?'"
+    if is_correct and ready_to_move:
+        return "WRAPPING UP", f"They said {selection}! Big celebration, then say 'Let's see another photo!'"
+    if ready_to_move:
+        return "WRAPPING UP", "Time to move on. Celebrate their participation, say 'Let's see another photo!'"
+    return "ENCOURAGING", (f"They picked {selection}. Be warm and encouraging! "
+                           f"Give a gentle hint about someone who IS in the photo: {people_in_photo}")
+
+# Byte-identical on every call so the provider can cache it; the photo
+# and then the turn follow
+PERSONA = """You are Sarah, a warm playful friend talking to My (a young woman).
+
+RULES:
+- Very short sentences (3-6 words max)
+- Be warm, playful, encouraging
+- NEVER say she's wrong
+- Only say "Let's see another photo!" if PHASE is WRAPPING UP
+- Add sounds like "Oooh" or "Mmm" or "Hehe"
+"""
+
+def build_prompt(selection, img_description, people_in_photo, turn, is_correct, ready_to_move):
+    phase, instruction = turn_phase(selection, people_in_photo, turn, is_correct, ready_to_move)
+    return f"""{PERSONA}
+IMAGE: {img_description}
+
+TURN: {turn}
+PHASE: {phase}
+MY PICKED: {selection}
+CORRECT: {is_correct}
+
+{instruction}
+"""
+
+def bank_key(photo_id, phase, selection, is_correct):
+    return f"{photo_id}|{phase}|{selection}|{int(bool(is_correct))}"
+
+# ---------------- BANK ----------------
+def _read():
+    """The bank as it is on disk ({} if missing or unreadable)."""
+    try:
+        with open(BANK_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _load():
+    """The bank, read from disk once per process. Caller holds _lock."""
+    global _bank
+    if _bank is None:
+        _bank = _read()
+    return _bank
+
+def _merge(bank, other):
+    """bank with other's variants added, up to MAX_VARIANTS per key."""
+    for key, variants in other.items():
+        kept = bank.setdefault(key, [])
+        for text in variants:
+            if text not in kept and len(kept) < MAX_VARIANTS:
+                kept.append(text)
+    return bank
+
+@contextlib.contextmanager
+def _file_lock():
+    """Hold the bank's lock file, so worker processes save one at a time
+    (a no-op where fcntl is missing)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(BANK_PATH + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def pick(key):
+    """A random variant for key, or None if the key is too thin."""
+    with _lock:
+        variants = _load().get(key, ())
+        choice = random.choice(variants) if len(variants) >= MIN_VARIANTS else None
+    metrics.inc("bank_hits" if choice is not None else "bank_misses")
+    return choice
+
+def add(key, text):
+    """Grow the bank with a fresh LLM reply."""
+    global _dirty
+    text = text.strip()
+    if not text:
+        return
+    with _lock:
+        variants = _load().setdefault(key, [])
+        if text in variants or len(variants) >= MAX_VARIANTS:
+            return
+        variants.append(text)
+        _dirty = True
+        due = time.monotonic() - _saved_at >= SAVE_INTERVAL
+    if due:
+        save()
+
+def save():
+    """Write the bank atomically if it changed.
+
+    Every worker process keeps its own copy, so the file is merged with
+    what is on disk under a file lock first; this process also picks up
+    the replies the others saved.
+    """
+    global _bank, _dirty, _saved_at
+    with _lock:
+        if not _dirty:
+            return
+        _dirty = False
+        _saved_at = time.monotonic()
+    try:
+        directory = os.path.dirname(BANK_PATH) or "."
+        os.makedirs(directory, exist_ok=True)
+        with _file_lock():
+            on_disk = _read()
+            with _lock:
+                _bank = _merge(on_disk, _load())
+                data = json.dumps(_bank, indent=1, sort_keys=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+                os.replace(tmp, BANK_PATH)
+            except OSError:
+                os.remove(tmp)
+                raise
+    except OSError:
+        with _lock:
+            _dirty = True
+
+atexit.register(save)
+
+def hit_rate():
+    hits = metrics.counters["bank_hits"]
+    total = hits + metrics.counters["bank_misses"]
+    return hits / total if total else 0.0
+
+# ---------------- BUILDING ----------------
+# Turn the prompt shows when filling offline: a first click, or one late
+# enough to wrap up (the bubble app's MIN_TURNS_PER_PHOTO)
+BUILD_TURNS = {False: 2, True: 4}
+
+def build_jobs(images):
+    """(key, prompt) for every key a click can reach."""
+    from phrases import ALL_RELATIONSHIPS
+    from relationships import extract_relationships
+
+    jobs = []
+    for img in images:
+        people = extract_relationships(img["description"])
+        for selection in ALL_RELATIONSHIPS:
+            is_correct = selection in people
+            for ready_to_move in (False, True):
+                turn = BUILD_TURNS[ready_to_move]
+                phase, _ = turn_phase(selection, people, turn, is_correct, ready_to_move)
+                prompt = build_prompt(selection, img["description"], people, turn, is_correct, ready_to_move)
+                jobs.append((bank_key(img["id"], phase, selection, is_correct), prompt))
+    return jobs
+
+def build(data_path, variants, workers):
+    import openai_client
+    import upstream
+    from openai_client import CHAT_MODEL, TIMEOUTS
+
+    with open(data_path) as f:
+        images = json.load(f)
+    client = openai_client.chat_client()
+    with _lock:
+        bank = _load()
+        needed = [(key, prompt) for key, prompt in build_jobs(images)
+                  for _ in range(max(0, variants - len(bank.get(key, ()))))]
+
+    def generate(prompt):
+        # Queued behind any live sessions in this process
+        response = upstream.in_background(
+            upstream.call,
+            "chat",
+            client.chat.completions.create,
+            hedged=False,
+            model=CHAT_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=60,
+            temperature=1.0,
+            timeout=TIMEOUTS["chat"]
+        )
+        openai_client.record_usage("bubbles", response.usage)
+        return response.choices[0].message.content
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate, prompt): key for key, prompt in needed}
+        for future in as_completed(futures):
+            try:
+                add(futures[future], future.result() or "")
+            except Exception as e:
+                failed += 1
+                print(f"failed: {futures[future]}: {e}", file=sys.stderr)
+    save()
+    with _lock:
+        keys = len(_load())
+        total = sum(len(v) for v in _load().values())
+    print(f"{keys} keys, {total} variants -> {BANK_PATH} ({len(needed)} requested, {failed} failed)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate bubble-app replies.")
+    parser.add_argument("--data", default="data/image_data.json")
+    parser.add_argument("--variants", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    sys.exit(build(args.data, args.variants, args.workers))
@@ -0,0 +1,165 @@
+"""Speculative pre-generation of the next turn and the next photo.
+
+In the bubble app the next input is always one of a handful of known
+choices, so while the child looks at the photo we compute the replies for
+the likeliest clicks in the background and serve the click from there.
+
+Both apps also know which photo comes next, so once a child is engaged
+with the current one, Lookahead loads the next photo (image and opening
+audio) and advancing does not have to wait for it.
+
+Both run their upstream calls as background work (see upstream), so
+they never hold up a turn the child is waiting on. Work that is taken
+is promoted to the front of the queue, or done on the spot if it has
+not started; work that is dropped leaves it.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import upstream
+
+# ---------------- CONFIG ----------------
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "4"))
+SPECULATIVE_LIMIT = int(os.getenv("SPECULATIVE_LIMIT", "4"))  # Choices precomputed per turn
+SPECULATIVE_WAIT = 15  # seconds a turn waits for a choice that is still in flight
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculate")
+
+def _count(name, n=1):
+    metrics.inc(f"speculative_{name}", n)
+
+# ---------------- SPECULATOR ----------------
+class Speculator:
+    """Per-session precomputed replies for the turn identified by `state`."""
+
+    def __init__(self):
+        self.state = None
+        self.futures = {}
+        self.work = {}
+
+    def prepare(self, state, choices, compute):
+        """Start compute(choice) for the first choices, likeliest first.
+
+        Does nothing if this turn is already being speculated.
+        """
+        if state == self.state:
+            return
+        self.cancel()
+        self.state = state
+        for choice in choices[:SPECULATIVE_LIMIT]:
+            work = self.work[choice] = upstream.Work()
+            self.futures[choice] = _executor.submit(upstream.run_as, work, compute, choice)
+
+    def take(self, state, choice):
+        """Return the precomputed result for choice, or None on a miss.
+
+        Everything else in flight for this turn is cancelled.
+        """
+        return wait(self.claim(state, choice))
+
+    def claim(self, state, choice):
+        """Like take(), but return the future without waiting for it, so
+        another thread can wait instead.
+
+        A choice whose job has not started yet is a miss: the executor is
+        first come, first served, so it would wait behind other sessions'
+        speculation however urgent its requests are. The caller does it
+        now instead.
+        """
+        future = self.futures.pop(choice, None) if state == self.state else None
+        work = self.work.pop(choice, None)
+        if future is not None and future.cancel():
+            _count("cancelled")
+            work.abandon()
+            future = None
+        elif future is not None:
+            work.promote()
+        self.cancel()
+        return future
+
+    def cancel(self):
+        cancelled = sum(1 for future in self.futures.values() if future.cancel())
+        if cancelled:
+            _count("cancelled", cancelled)
+        for work in self.work.values():
+            work.abandon()
+        self.futures = {}
+        self.work = {}
+        self.state = None
+
+def wait(future, timeout=SPECULATIVE_WAIT):
+    """Result of a claimed future, or None on a miss, failure or timeout."""
+    if future is None:
+        _count("misses")
+        return None
+    try:
+        result = future.result(timeout=timeout)
+    except Exception as e:
+        log.warning("Speculative turn failed: %s", e)
+        result = None
+    _count("hits" if result is not None else "misses")
+    return result
+
+# ---------------- LOOKAHEAD ----------------
+class Lookahead:
+    """Per-session background load of one upcoming photo."""
+
+    def __init__(self):
+        self.idx = None
+        self.future = None
+        self.work = None
+
+    def prepare(self, idx, compute):
+        """Start compute() for photo idx, unless it is already loading."""
+        if idx == self.idx:
+            return
+        self.cancel()
+        self.idx = idx
+        self.work = upstream.Work()
+        self.future = _executor.submit(upstream.run_as, self.work, compute)
+
+    def take(self, idx):
+        """Return what was loaded for photo idx, or None if it is not ready.
+
+        Never waits, as the script thread calls it. A load not yet started
+        is dropped; one already running is promoted and left to finish, so
+        the caller's own requests for the photo join its (see upstream).
+        """
+        future = self.future if idx == self.idx else None
+        if future is not None and not future.done() and not future.cancel():
+            self.work.promote()
+            self.work = None
+        self.cancel()
+        if future is None or not future.done() or future.cancelled():
+            metrics.inc("lookahead_misses")
+            return None
+        try:
+            result = future.result()
+        except Exception as e:
+            log.warning("Lookahead failed: %s", e)
+            result = None
+        metrics.inc("lookahead_hits" if result is not None else "lookahead_misses")
+        return result
+
+    def cancel(self):
+        if self.future is not None and self.future.cancel():
+            _count("cancelled")
+        if self.work is not None:
+            self.work.abandon()
+        self.idx = None
+        self.future = None
+        self.work = None
+
+def hit_rate():
+    hits = metrics.counters["speculative_hits"]
+    total = hits + metrics.counters["speculative_misses"]
+    return hits / total if total else 0.0
+
+def lookahead_hit_rate():
+    hits = metrics.counters["lookahead_hits"]
+    total = hits + metrics.counters["lookahead_misses"]
+    return hits / total if total else 0.0
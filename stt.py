@@ -0,0 +1,60 @@
+"""Whisper transcription straight from the recorder bytes.
+
+Nothing touches disk: the bytes go into the multipart upload as-is, each
+request carries its session's id, and the call runs on a worker thread.
+
+With STT_BACKEND=local the in-process engine (local_speech) answers
+first and Whisper is only called when it is unavailable or unsure.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import local_speech
+import metrics
+import upstream
+import vad
+from openai_client import bounded
+
+# ---------------- CONFIG ----------------
+STT_MODEL = "whisper-1"
+STT_WORKERS = int(os.getenv("STT_WORKERS", "8"))
+STT_BACKEND = os.getenv("STT_BACKEND", "remote")  # remote | local
+LOCAL_STT_MIN_CONFIDENCE = float(os.getenv("LOCAL_STT_MIN_CONFIDENCE", "0.85"))
+
+_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+
+# ---------------- HELPERS ----------------
+def transcribe(client, audio_bytes, request_id, deadline=None):
+    """Transcribe in-memory WAV bytes, hedged and bounded by deadline
+    (see deadlines), within the endpoint's limits (see upstream). Raises
+    on API failure or timeout."""
+    response = upstream.call(
+        "transcription",
+        bounded(client, "audio.transcriptions.create", "transcription", deadline),
+        deadline=deadline,
+        model=STT_MODEL,
+        file=vad.encode(audio_bytes),
+        extra_headers={"X-Request-Id": request_id}
+    )
+    return response.text.strip()
+
+def transcribe_local(client, audio_bytes, request_id, deadline=None):
+    """Transcribe on the local engine, falling back to Whisper when it is
+    unavailable or below LOCAL_STT_MIN_CONFIDENCE."""
+    heard = local_speech.transcribe(audio_bytes)
+    if heard is not None:
+        text, confidence = heard
+        if text and confidence >= LOCAL_STT_MIN_CONFIDENCE:
+            metrics.inc("stt_local")
+            return text
+    metrics.inc("stt_local_fallback")
+    return transcribe(client, audio_bytes, request_id, deadline)
+
+BACKENDS = {
+    "remote": transcribe,
+    "local": transcribe_local,
+}
+
+def submit(client, audio_bytes, request_id, deadline=None):
+    """Start a transcription on the worker pool and return its future."""
+    return _executor.submit(BACKENDS[STT_BACKEND], client, audio_bytes, request_id, deadline)
@@ -0,0 +1,21 @@
+"""The relationship matcher against the corpus of descriptions and
+transcripts in data/relationship_corpus.json.
+
+    python -m pytest -q test_relationships.py
+"""
+import json
+import os
+
+import pytest
+
+import relationships
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "relationship_corpus.json")
+
+with open(CORPUS) as f:
+    CASES = json.load(f)
+
+@pytest.mark.parametrize("case", CASES, ids=[case["text"] for case in CASES])
+def test_corpus(case):
+    got = relationships.find(case["text"], spoken=case.get("spoken", False))
+    assert sorted(got) == sorted(case["expect"])
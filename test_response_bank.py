@@ -0,0 +1,33 @@
+"""Saving the response bank must keep replies other worker processes saved.
+
+    python -m pytest -q test_response_bank.py
+"""
+import json
+import time
+
+import pytest
+
+import response_bank
+
+@pytest.fixture
+def bank_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "response_bank.json")
+    monkeypatch.setattr(response_bank, "BANK_PATH", path)
+    monkeypatch.setattr(response_bank, "_bank", None)
+    monkeypatch.setattr(response_bank, "_dirty", False)
+    monkeypatch.setattr(response_bank, "_saved_at", time.monotonic())  # add() leaves saving to the test
+    return path
+
+def test_save_merges_with_other_workers(bank_path):
+    response_bank.add("photo|OPENING|Mom|1", "Oooh, Mom!")
+    # Another worker saved in the meantime
+    with open(bank_path, "w") as f:
+        json.dump({"photo|OPENING|Mom|1": ["Yay, Mom!"], "photo|OPENING|Dad|0": ["Hmm, look again!"]}, f)
+    response_bank.save()
+    with open(bank_path) as f:
+        saved = json.load(f)
+    assert saved == {
+        "photo|OPENING|Mom|1": ["Yay, Mom!", "Oooh, Mom!"],
+        "photo|OPENING|Dad|0": ["Hmm, look again!"],
+    }
+    assert response_bank._load() == saved
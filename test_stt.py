@@ -0,0 +1,51 @@
+"""Concurrent transcriptions must never hand one session another's audio.
+
+    python -m pytest -q test_stt.py
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+import stt
+
+SESSIONS = 50
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Transcription endpoint that answers with what it was sent."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.05)
+        # The upload holds the session's id; echo both so the test can
+        # check audio and identity stayed paired
+        marker = body.split(b"SESSION:", 1)[1].split(b"\x00", 1)[0].decode()
+        payload = json.dumps({"text": f"{marker}|{self.headers['X-Request-Id']}"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(stt, "STT_BACKEND", "remote")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield openai.Client(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1")
+    server.shutdown()
+
+def test_concurrent_sessions_keep_their_own_transcripts(client):
+    futures = {}
+    for i in range(SESSIONS):
+        request_id = f"session-{i}"
+        audio = b"RIFF" + f"SESSION:{request_id}".encode() + b"\x00" * 32000
+        futures[request_id] = stt.submit(client, audio, request_id)
+    crossed = [rid for rid, f in futures.items() if f.result(timeout=30) != f"{rid}|{rid}"]
+    assert not crossed
@@ -0,0 +1,131 @@
+"""Upstream coordination: single-flight must not hand one caller's failure
+to the others, a slot is held as long as its request runs, and a hedge
+only goes out on a slot of its own.
+
+    python -m pytest -q test_upstream.py
+"""
+import threading
+import time
+
+import pytest
+
+import deadlines
+import upstream
+
+@pytest.fixture
+def chat(monkeypatch):
+    """A one-slot chat limiter, with its only slot held until released."""
+    monkeypatch.setitem(upstream._limiters, "chat", upstream.Limiter("chat", 1, 60000))
+    monkeypatch.setattr(deadlines, "HEDGING", False)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with upstream.slot("chat"):
+            held.set()
+            release.wait(5)
+
+    threading.Thread(target=hold, daemon=True).start()
+    held.wait(5)
+    return release
+
+def start(fn, *args, **kwargs):
+    """Run fn on a thread; returns a dict that gets "result" or "error"."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = fn(*args, **kwargs)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    outcome["thread"] = thread
+    return outcome
+
+def wait_queued(n):
+    deadline = time.monotonic() + 5
+    while len(upstream._limiters["chat"]._waiting) < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_follower_survives_abandoned_background_leader(chat):
+    background = upstream.Work()
+    leader = start(upstream.run_as, background, upstream.call, "chat", lambda: "reply", key="k")
+    wait_queued(1)
+    follower = start(upstream.call, "chat", lambda: "reply", key="k")
+    time.sleep(0.05)
+    background.abandon()
+    chat.set()
+    follower["thread"].join(5)
+    assert follower.get("result") == "reply", follower.get("error")
+    leader["thread"].join(5)
+
+def test_follower_reissues_after_leader_runs_out_of_time(chat):
+    leader = start(upstream.call, "chat", lambda: "reply", key="k", deadline=deadlines.Deadline(0.2))
+    wait_queued(1)
+    follower = start(upstream.call, "chat", lambda: "reply", key="k")
+    leader["thread"].join(5)
+    assert isinstance(leader.get("error"), deadlines.DeadlineExceeded)
+    chat.set()
+    follower["thread"].join(5)
+    assert follower.get("result") == "reply", follower.get("error")
+
+def test_interactive_follower_promotes_the_flight(chat):
+    served = []
+    other = start(upstream.in_background, upstream.call, "chat", lambda: served.append("other"), key="other")
+    wait_queued(1)
+    leader = start(upstream.in_background, upstream.call, "chat", lambda: served.append("shared"), key="k")
+    wait_queued(2)
+    follower = start(upstream.call, "chat", lambda: served.append("shared"), key="k")
+    time.sleep(0.05)
+    chat.set()
+    for outcome in (other, leader, follower):
+        outcome["thread"].join(5)
+    assert served == ["shared", "other"]
+
+def test_timed_out_call_holds_its_slot_until_it_finishes(monkeypatch):
+    limiter = upstream.Limiter("chat", 1, 60000)
+    monkeypatch.setitem(upstream._limiters, "chat", limiter)
+    monkeypatch.setattr(deadlines, "HEDGING", False)
+    finish = threading.Event()
+    with pytest.raises(deadlines.DeadlineExceeded):
+        upstream.call("chat", finish.wait, 5, deadline=deadlines.Deadline(0.1))
+    assert limiter.active == 1
+    finish.set()
+    deadline = time.monotonic() + 5
+    while limiter.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.active == 0
+
+def test_hedge_is_skipped_without_a_free_slot(monkeypatch):
+    limiter = upstream.Limiter("chat", 1, 60000)
+    monkeypatch.setitem(upstream._limiters, "chat", limiter)
+    monkeypatch.setattr(deadlines, "expected", lambda stage: 0.05)
+    calls = []
+
+    def slow():
+        calls.append(limiter.active)
+        time.sleep(0.2)
+        return "reply"
+
+    assert upstream.call("chat", slow) == "reply"
+    assert calls == [1]
+
+def test_hedge_takes_a_slot_of_its_own(monkeypatch):
+    limiter = upstream.Limiter("chat", 2, 60000)
+    monkeypatch.setitem(upstream._limiters, "chat", limiter)
+    monkeypatch.setattr(deadlines, "expected", lambda stage: 0.05)
+    calls = []
+
+    def slow():
+        calls.append(limiter.active)
+        time.sleep(0.2)
+        return "reply"
+
+    assert upstream.call("chat", slow) == "reply"
+    assert calls == [1, 2]
+    deadline = time.monotonic() + 5
+    while limiter.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.active == 0
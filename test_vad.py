@@ -0,0 +1,29 @@
+"""Endpointing: one-word answers must not shorten the recorder's pause
+threshold, and a turn that looks cut off sends it back to the default.
+
+    python -m pytest -q test_vad.py
+"""
+import vad
+
+def turn(runs, longest_pause=0.0, trailing=2.0):
+    return {"speech": 1.0, "runs": runs, "longest_pause": longest_pause, "trailing": trailing}
+
+def test_one_word_answers_do_not_lower_the_threshold():
+    endpointing = vad.Endpointing()
+    for _ in range(4):
+        endpointing.update(turn(1))
+    assert endpointing.pause_threshold == vad.DEFAULT_PAUSE_THRESHOLD
+
+def test_learned_threshold_stays_above_the_minimum():
+    endpointing = vad.Endpointing()
+    endpointing.update(turn(2, longest_pause=0.2))
+    endpointing.update(turn(3, longest_pause=0.3))
+    assert endpointing.pause_threshold == vad.MIN_PAUSE_THRESHOLD
+
+def test_turn_ended_at_a_learned_threshold_resets_it():
+    endpointing = vad.Endpointing()
+    endpointing.update(turn(2, longest_pause=1.0))
+    endpointing.update(turn(2, longest_pause=1.0))
+    assert endpointing.pause_threshold == 1.4
+    endpointing.update(turn(1, trailing=1.4))
+    assert endpointing.pause_threshold == vad.DEFAULT_PAUSE_THRESHOLD
@@ -0,0 +1,157 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+import audio_pack
+import audio_server
+import local_speech
+import metrics
+import tts_cache
+import upstream
+from openai_client import bounded
+from phrases import sanitize_text
+
+# ---------------- CONFIG ----------------
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"
+TTS_SPEED = 0.75
+TTS_FORMAT = "mp3"
+STREAM_CHUNK_SIZE = 4096
+TTS_BACKEND = os.getenv("TTS_BACKEND", "remote")  # remote | local (Piper, falling back to remote)
+
+log = logging.getLogger(__name__)
+
+# ---------------- HELPERS ----------------
+def clip_key(text, fmt=TTS_FORMAT):
+    """Cache key for already-sanitized text with the app's voice settings."""
+    return tts_cache.cache_key(text, TTS_MODEL, TTS_VOICE, TTS_SPEED, fmt)
+
+def lookup(text, fmt=TTS_FORMAT):
+    """Return pre-rendered or cached audio for text, or None."""
+    text = sanitize_text(text)
+    if not text:
+        return None
+    key = clip_key(text, fmt)
+    return audio_pack.get(key) or tts_cache.get(key)
+
+def local_clip_key(text):
+    """Cache key for text rendered by the local voice."""
+    return tts_cache.cache_key(text, "piper", os.path.basename(local_speech.PIPER_MODEL_PATH), TTS_SPEED, "wav")
+
+def _synthesize_local(text):
+    """WAV from the local voice (cached), or None to use the API instead."""
+    key = local_clip_key(text)
+    audio = tts_cache.get(key)
+    if audio:
+        return audio
+    try:
+        audio = local_speech.synthesize(text, TTS_SPEED)
+    except Exception as e:
+        log.warning("Local TTS failed: %s", e)
+        audio = None
+    if not audio:
+        metrics.inc("tts_local_fallback")
+        return None
+    metrics.inc("tts_local")
+    tts_cache.put(key, audio)
+    return audio
+
+def synthesize(client, text, backend=None, deadline=None, fmt=TTS_FORMAT):
+    """Return audio for text from the pack, the cache, the local voice
+    (with TTS_BACKEND=local) or the API.
+
+    Pre-rendered and cached API audio wins over the local voice. The API
+    call is hedged and bounded by deadline (see deadlines), and shared
+    with any session synthesizing the same text (see upstream). fmt is
+    the API's response_format; the local voice always returns WAV. Raises
+    on API failure or timeout so callers decide how to surface it.
+    """
+    text = sanitize_text(text)
+    if not text:
+        return None
+    key = clip_key(text, fmt)
+    audio = audio_pack.get(key) or tts_cache.get(key)
+    if not audio and (backend or TTS_BACKEND) == "local":
+        audio = _synthesize_local(text)
+    if audio:
+        return audio
+    speech = upstream.call(
+        "speech",
+        bounded(client, "audio.speech.create", "speech", deadline),
+        key=key,
+        deadline=deadline,
+        model=TTS_MODEL,
+        voice=TTS_VOICE,
+        input=text,
+        speed=TTS_SPEED,
+        response_format=fmt
+    )
+    tts_cache.put(key, speech.content)
+    return speech.content
+
+def _stream_into(client, text, key, stream, deadline=None):
+    start = time.perf_counter()
+    first_byte = None
+    create = bounded(client, "audio.speech.with_streaming_response.create", "speech", deadline)
+    try:
+        with upstream.slot("speech", deadline), create(
+            model=TTS_MODEL,
+            voice=TTS_VOICE,
+            input=text,
+            speed=TTS_SPEED,
+            response_format=TTS_FORMAT
+        ) as response:
+            for chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                stream.feed(chunk)
+    except Exception as e:
+        log.warning("TTS stream failed: %s", e)
+        stream.close(error=e)
+        return
+    total = time.perf_counter() - start
+    audio = stream.content()
+    stream.timings = {"first_byte": first_byte or total, "total": total, "bytes": len(audio)}
+    stream.close()
+    tts_cache.put(key, audio)
+    log.info("TTS stream: first byte %.0f ms, total %.0f ms, %d bytes",
+             stream.timings["first_byte"] * 1000, total * 1000, len(audio))
+
+def synthesize_streaming(client, text, host=None, deadline=None):
+    """Like synthesize, but uncached text comes back as a URL that starts
+    playing as soon as the first audio frames arrive. Each read of the
+    stream is bounded by deadline. Without the audio sidecar (its port
+    taken) the text is synthesized in full instead."""
+    text = sanitize_text(text)
+    if not text:
+        return None
+    key = clip_key(text)
+    audio = audio_pack.get(key) or tts_cache.get(key)
+    if not audio and TTS_BACKEND == "local":
+        audio = _synthesize_local(text)  # Fast enough that streaming would not help
+    if audio:
+        return audio
+    if not audio_server.ensure_started():
+        return synthesize(client, text, "remote", deadline)  # No sidecar to stream from
+    stream = audio_server.AudioStream()
+    path = audio_server.register(stream)
+    threading.Thread(target=_stream_into, args=(client, text, key, stream, deadline), daemon=True).start()
+    return audio_server.url_for(path, host)
+
+if __name__ == "__main__":
+    # Compare time-to-first-byte against full synthesis for one line:
+    #   python tts.py "Oooh, look at this photo! Who do you see?"
+    import openai_client
+    from phrases import slow_text
+
+    client = openai_client.get_client()
+    text = sanitize_text(slow_text(" ".join(sys.argv[1:]) or "Oooh, look at this photo! Who do you see?"))
+    stream = audio_server.AudioStream()
+    _stream_into(client, text, clip_key(text), stream)
+    if stream.error:
+        sys.exit(f"TTS failed: {stream.error}")
+    t = stream.timings
+    print(f"first byte {t['first_byte'] * 1000:.0f} ms, total {t['total'] * 1000:.0f} ms, "
+          f"{t['bytes']} bytes ({t['total'] / t['first_byte']:.1f}x sooner to first audio)")
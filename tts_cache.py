@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# ---------------- CONFIG ----------------
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".cache/tts")
+MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# Puts between rescans of the directory. Other worker processes write to
+# it too, so each process's running total drifts low until the next scan
+RESCAN_PUTS = int(os.getenv("TTS_CACHE_RESCAN_PUTS", "64"))
+STALE_TMP_SECONDS = 600  # a .tmp file this old was left by a write that died
+
+_lock = threading.Lock()
+_approx_size = None
+_puts_since_scan = 0
+
+# ---------------- HELPERS ----------------
+def cache_key(text, model, voice, speed, fmt):
+    """Content address for one synthesized clip."""
+    payload = json.dumps([text, model, voice, speed, fmt], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _path(key):
+    return os.path.join(CACHE_DIR, f"{key}.audio")
+
+def _scan():
+    """List (mtime, size, path) for every cached clip, deleting temp
+    files that writes killed midway left behind."""
+    entries = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return entries
+    stale = time.time() - STALE_TMP_SECONDS
+    for name in names:
+        if not name.endswith((".audio", ".tmp")):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+            if name.endswith(".tmp"):
+                if st.st_mtime < stale:
+                    os.remove(path)
+                continue
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+def get(key):
+    """Return cached audio bytes, or None on a miss."""
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        # Bump mtime so eviction sees this clip as recently used
+        os.utime(path)
+    except OSError:
+        pass
+    return data or None
+
+def put(key, data):
+    """Store audio bytes atomically, then evict if over budget. A disk
+    error only loses the clip from the cache; the caller still has it."""
+    global _approx_size, _puts_since_scan
+    if not data:
+        return
+    tmp = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        try:
+            replaced = os.stat(_path(key)).st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # Rename is atomic, so other sessions and worker processes
+        # never see a half-written clip
+        os.replace(tmp, _path(key))
+    except OSError:
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        return
+
+    with _lock:
+        _puts_since_scan += 1
+        if _approx_size is None or _puts_since_scan >= RESCAN_PUTS:
+            _approx_size = sum(size for _, size, _ in _scan())
+            _puts_since_scan = 0
+        else:
+            _approx_size += len(data) - replaced
+        if _approx_size > MAX_BYTES:
+            _approx_size = _evict()
+
+def _evict():
+    """Drop least recently used clips until under 90% of the budget."""
+    entries = sorted(_scan())
+    total = sum(size for _, size, _ in entries)
+    target = int(MAX_BYTES * 0.9)
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
@@ -0,0 +1,89 @@
+"""Turns run off the script thread.
+
+A click or a recording used to hold the script run through transcription,
+the LLM and TTS, so nothing on screen changed until all three were done.
+Now the script hands the turn to a shared executor and returns at once.
+The job publishes Sarah's text as soon as the LLM answers and the audio
+when TTS finishes, and a fragment polling every POLL_INTERVAL shows each
+as it lands. The poll that finds the turn done reruns the app, whose
+next run no longer draws the polling fragment, so Streamlit stops its
+timer.
+
+Each session has a TurnRunner holding its one current job. Starting a
+new turn or calling supersede() (e.g. on "Next Photo") drops the current
+job: it still runs to completion, but nothing reads its results.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# ---------------- CONFIG ----------------
+TURN_WORKERS = int(os.getenv("TURN_WORKERS", "16"))
+POLL_INTERVAL = 0.25  # seconds between checks while a turn is in flight
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=TURN_WORKERS, thread_name_prefix="turn")
+
+# ---------------- JOBS ----------------
+class Job:
+    """One turn in flight. The worker sets text, then audio, then done."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.text = None
+        self.audio = None
+        self.errors = []  # messages to show the user
+        self.result = {}  # anything else the turn reports back
+        self.done = False
+
+def _run(job, work, args):
+    try:
+        work(job, *args)
+    except Exception as e:
+        log.exception("Turn failed for session %s", job.session_id)
+        job.errors.append(f"Turn failed: {e}")
+    finally:
+        job.done = True
+        metrics.observe("turn_job", time.perf_counter() - job.started)
+
+class TurnRunner:
+    """A session's current background turn."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.job = None
+
+    def start(self, work, *args, inline=False):
+        """Run work(job, *args) on the shared executor as this session's turn.
+
+        inline runs it on the calling thread instead, for turns with
+        nothing left to do but bookkeeping (a speculated reply whose audio
+        is ready to play). Such work must not call out or encode.
+        """
+        self.supersede()
+        self.job = Job(self.session_id)
+        if inline:
+            _run(self.job, work, args)
+        else:
+            _executor.submit(_run, self.job, work, args)
+        return self.job
+
+    def supersede(self):
+        """Drop the current job; whatever it still produces is discarded."""
+        if self.job is not None and not self.job.done:
+            metrics.inc("turns_superseded")
+        self.job = None
+
+    def collect(self):
+        """Take the current job once it is done, else None."""
+        job = self.job
+        if job is None or not job.done:
+            return None
+        self.job = None
+        return job
+
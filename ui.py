@@ -0,0 +1,265 @@
+"""Streamlit code shared by the bubbles app (app.py) and the speech app
+(app_speech.py): the OpenAI clients, run timing, playing audio, session
+state, the photo, Sarah's reply and the celebration screen.
+
+Both scripts import this once per process, so nothing per session lives
+in module globals; it is all in st.session_state.
+"""
+import functools
+import os
+import time
+import uuid
+
+import streamlit as st
+
+import audio_format
+import audio_server
+import clip_store
+import metrics
+import openai_client
+import photos
+import speculative
+import tts
+import turns
+from phrases import CELEBRATION
+
+# ---------------- CONFIG ----------------
+api_key = st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
+client = openai_client.get_client(api_key)
+chat_client = openai_client.chat_client(api_key)
+
+TTS_STREAMING = os.getenv("TTS_STREAMING") == "1"  # Needs the audio sidecar reachable from the browser
+COMPOSED_SPEECH = os.getenv("COMPOSED_SPEECH", "1") == "1"  # Splice replies from cached phrases (see compose)
+
+# ---------------- RUNS ----------------
+def start_run():
+    """Start timing a full script run. Call first thing in the script."""
+    st.session_state.run_started = time.perf_counter()
+    st.session_state.run_finished = False
+
+def finish_run():
+    """Record how long this script run took."""
+    metrics.observe("rerun", time.perf_counter() - st.session_state.run_started)
+    st.session_state.run_finished = True
+
+def rerun(scope="app"):
+    """Record this run's time, then rerun the script (or just the fragment)."""
+    finish_run()
+    st.rerun(scope=scope)
+
+def fragment_started():
+    """Start timing a fragment-only run; True if this call started it.
+
+    Those call the fragment without re-executing the script, so the last
+    full run has already finished. A fragment drawn inside a run already
+    being timed returns False.
+    """
+    if not st.session_state.run_finished:
+        return False
+    st.session_state.run_started = time.perf_counter()
+    st.session_state.run_finished = False
+    return True
+
+def fragment_finished(started):
+    """Record a fragment-only run started by fragment_started()."""
+    if started:
+        finish_run()
+
+# ---------------- AUDIO ----------------
+def host():
+    """The Host header the browser reached the app on."""
+    return st.context.headers.get("Host")
+
+def payload_size(audio):
+    """Bytes of audio in a stored clip (0 for a stream URL)."""
+    return audio.size if isinstance(audio, clip_store.Clip) else 0
+
+def as_clip(audio):
+    """Finished audio bytes become a shared clip; stream URLs pass through."""
+    return clip_store.put(audio) if isinstance(audio, bytes) else audio
+
+def audio_tier():
+    """This browser's audio format (see audio_format)."""
+    client = audio_format.client_of(st.context.headers, st.context.ip_address)
+    return audio_format.tier_for(client, st.context.headers.get("User-Agent", ""))
+
+def play(audio):
+    """Autoplay a clip or stream URL, in the session's format (see audio_format).
+
+    The session keeps the clip referenced until the next one plays, so it
+    stays in the store while the browser fetches it.
+    """
+    audio = audio_format.deliver(audio, audio_tier())
+    st.audio(audio_server.playable(audio, host()), autoplay=True)
+    st.session_state.playing = audio
+
+def speak(text, host, deadline=None):
+    """Call OpenAI TTS, reusing pre-rendered or cached audio for repeat phrases.
+
+    In streaming mode new text comes back as a URL that starts playing
+    before synthesis finishes; pack and cache hits are clips either way. No Streamlit calls, so turn jobs can use
+    it; raises on failure or when the deadline runs out.
+    """
+    if TTS_STREAMING:
+        return as_clip(tts.synthesize_streaming(client, text, host, deadline))
+    return as_clip(tts.synthesize(client, text, deadline=deadline))
+
+def shown(make):
+    """make() from the script, showing a failure instead of raising."""
+    try:
+        return make()
+    except Exception as e:
+        st.error(f"TTS failed: {e}")
+        return None
+
+def tts_speak(text):
+    """speak() from the script, showing failures."""
+    return shown(functools.partial(speak, text, host()))
+
+# ---------------- SESSION STATE ----------------
+def init_state():
+    """The session state both apps keep; each adds its own."""
+    if "idx" not in st.session_state:
+        st.session_state.idx = 0
+    if "turn" not in st.session_state:
+        st.session_state.turn = 0  # Total turns on current photo
+    if "sarah_text" not in st.session_state:
+        st.session_state.sarah_text = ""
+    if "audio_clip" not in st.session_state:
+        st.session_state.audio_clip = None  # Clip or stream URL waiting to play
+    if "playing" not in st.session_state:
+        st.session_state.playing = None
+    if "has_spoken" not in st.session_state:
+        st.session_state.has_spoken = False
+    if "all_done" not in st.session_state:
+        st.session_state.all_done = False
+    if "lookahead" not in st.session_state:
+        st.session_state.lookahead = speculative.Lookahead()
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if "runner" not in st.session_state:
+        st.session_state.runner = turns.TurnRunner(st.session_state.session_id)
+
+def next_photo(total_photos):
+    """Move to the next photo, or to the celebration after the last."""
+    st.session_state.idx += 1
+    if st.session_state.idx >= total_photos:
+        st.session_state.all_done = True
+    st.session_state.turn = 0
+    st.session_state.has_spoken = False
+
+# ---------------- ALL DONE ----------------
+def all_done(reset):
+    """The celebration screen. Start Over clears the shared state, then
+    calls reset() for the app's own. Ends the run."""
+    st.markdown("<div class='celebration'>All done! Great job, My!</div>", unsafe_allow_html=True)
+    celebration_audio = tts_speak(CELEBRATION)
+    if celebration_audio:
+        play(celebration_audio)
+
+    if st.button("Start Over"):
+        st.session_state.runner.supersede()
+        st.session_state.idx = 0
+        st.session_state.turn = 0
+        st.session_state.sarah_text = ""
+        st.session_state.audio_clip = None
+        st.session_state.has_spoken = False
+        st.session_state.all_done = False
+        reset()
+        rerun()
+    finish_run()
+    st.stop()
+
+# ---------------- PHOTO ----------------
+def show_photo(img, total_photos, width):
+    """Progress and the photo. Returns the opening audio the lookahead
+    prepared for it, if any."""
+    # A new photo may have been loaded while the child was on the last one
+    prefetched = None
+    if not st.session_state.has_spoken and st.session_state.idx > 0:
+        with metrics.span("lookahead"):
+            prefetched = st.session_state.lookahead.take(st.session_state.idx)
+
+    st.markdown(f"<div class='progress'>Photo {st.session_state.idx + 1} of {total_photos}</div>",
+                unsafe_allow_html=True)
+
+    if img["exists"]:
+        with metrics.span("image"):
+            st.image(photos.fit(img["path"], width))
+    return prefetched
+
+def say_opening(app, text, prefetched, opening_clip):
+    """Sarah's opening line for a new photo: the prefetched audio, else
+    opening_clip() now, in the session's format. The line is the same on
+    every photo, so only the process's first opening per format waits
+    for the encoder."""
+    st.session_state.sarah_text = text
+    turn_metrics = metrics.Turn(app, st.session_state.session_id)
+    with turn_metrics.span("tts"):
+        st.session_state.audio_clip = prefetched or shown(
+            lambda: audio_format.encoded(opening_clip(), audio_tier()))
+    turn_metrics.record("audio_bytes", payload_size(st.session_state.audio_clip))
+    turn_metrics.finish()
+    st.session_state.has_spoken = True
+    st.session_state.turn = 1
+
+def prefetch_photo(img, width, opening_clip, tier):
+    """Image and opening audio (in tier's format) for an upcoming photo,
+    computed off the script thread."""
+    if img["exists"]:
+        photos.fit(img["path"], width)
+    try:
+        return audio_format.encoded(opening_clip(), tier)
+    except Exception:
+        return None
+
+def look_ahead(images, width, opening_clip):
+    """Once the child is playing, load the next photo in the background."""
+    next_idx = st.session_state.idx + 1
+    if st.session_state.turn > 1 and next_idx < len(images):
+        st.session_state.lookahead.prepare(
+            next_idx, functools.partial(prefetch_photo, images[next_idx], width, opening_clip, audio_tier()))
+
+# ---------------- REPLY ----------------
+def show_reply(keep_playing=False):
+    """Sarah's text, and her audio if it has not played yet. keep_playing
+    redraws the clip already playing, for a fragment run that would
+    otherwise drop it mid-sentence (the browser does not autoplay it twice)."""
+    st.markdown(f"<div class='sarah'>{st.session_state.sarah_text}</div>", unsafe_allow_html=True)
+    if st.session_state.audio_clip:
+        play(st.session_state.audio_clip)
+        st.session_state.audio_clip = None
+    elif keep_playing and st.session_state.playing is not None:
+        st.audio(audio_server.playable(st.session_state.playing, host()), autoplay=True)
+
+@st.fragment(run_every=turns.POLL_INTERVAL)
+def live_reply(finish_turn):
+    """show_reply() while a turn is in flight: the text as soon as the LLM
+    answers, the audio once the turn is done.
+
+    Only a poll may finish the turn; drawn inline by the parent, its timer
+    is already running for the next one. The finishing poll draws the
+    reply itself, so only this fragment reruns unless finish_turn moves to
+    a new photo. The timer runs on until the parent next redraws without
+    a turn in flight; polls in between only redraw the reply.
+    """
+    started = fragment_started()
+    job = st.session_state.runner.job
+    if job is not None and job.text is not None:
+        st.session_state.sarah_text = job.text
+    finished = st.session_state.runner.collect() if started else None
+    if finished:
+        finish_turn(finished)
+    show_reply(keep_playing=started and st.session_state.runner.job is None)
+    fragment_finished(started)
+
+def reply(finish_turn):
+    """Sarah's line: the turn's reply as it arrives, or the last one.
+    finish_turn(job) takes in a finished turn."""
+    finished = st.session_state.runner.collect()
+    if finished:
+        finish_turn(finished)
+    if st.session_state.runner.job is not None:
+        live_reply(finish_turn)
+    else:
+        show_reply()
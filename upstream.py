@@ -0,0 +1,326 @@
+"""Process-wide coordination of upstream API calls.
+
+All sessions share one process, so this is the place to stop them from
+stampeding OpenAI:
+
+- Single-flight: identical requests in flight at the same time (the
+  same opening line being synthesized for several tablets that reached
+  the same photo) become one upstream call whose result they share. The
+  shared call queues as urgently as its most urgent caller, and is only
+  abandoned once all of them are; if it fails on the first caller's own
+  account (abandoned, or out of that caller's time), the others ask again.
+- Per-endpoint limits: at most `concurrency` calls in flight, started at
+  no more than `rpm` per minute (a token bucket allowing short bursts),
+  so bursts queue here instead of drawing 429s and slow retries.
+- Priority: the queue serves interactive turns first. Speculation and
+  photo lookahead run as background Work and wait behind them; work is
+  promoted once the child is waiting on it, and dropped from the queue
+  once nobody will use it.
+
+Queue depth, queue wait (per priority), requests and merges are recorded
+in metrics.
+"""
+import functools
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import deadlines
+import metrics
+
+# ---------------- CONFIG ----------------
+# Defaults sit at OpenAI's tier-1 request rates
+LIMITS = {
+    "chat": {
+        "concurrency": int(os.getenv("CHAT_CONCURRENCY", "16")),
+        "rpm": float(os.getenv("CHAT_RPM", "500")),
+    },
+    "speech": {
+        "concurrency": int(os.getenv("SPEECH_CONCURRENCY", "16")),
+        "rpm": float(os.getenv("SPEECH_RPM", "500")),
+    },
+    "transcription": {
+        "concurrency": int(os.getenv("TRANSCRIPTION_CONCURRENCY", "16")),
+        "rpm": float(os.getenv("TRANSCRIPTION_RPM", "500")),
+    },
+}
+BURST_SECONDS = 2  # a full bucket holds this many seconds' worth of requests
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+class Abandoned(Exception):
+    """Background work was abandoned while its request queued."""
+
+# ---------------- PRIORITY ----------------
+class Work:
+    """Where one piece of work's requests queue."""
+
+    def __init__(self, level=BACKGROUND):
+        self.level = level
+        self.abandoned = False
+
+    def promote(self):
+        """Someone is waiting on this now: queue it with interactive turns."""
+        if self.level != INTERACTIVE:
+            self.level = INTERACTIVE
+            _wake_all()
+
+    def abandon(self):
+        """Nobody will use this: its queued requests give up."""
+        if not self.abandoned:
+            self.abandoned = True
+            _wake_all()
+
+_work = ContextVar("upstream_work", default=Work(INTERACTIVE))
+
+class _Joint:
+    """The Work of a merged request: as urgent as its most urgent caller,
+    abandoned only once every caller is."""
+
+    def __init__(self, work):
+        self.members = [work]
+
+    @property
+    def level(self):
+        return min(work.level for work in self.members)
+
+    @property
+    def abandoned(self):
+        return all(work.abandoned for work in self.members)
+
+    def join(self, work):
+        self.members.append(work)
+        _wake_all()
+
+def run_as(work, fn, *args, **kwargs):
+    """Call fn with its upstream requests queued as work."""
+    token = _work.set(work)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _work.reset(token)
+
+def in_background(fn, *args, **kwargs):
+    """Call fn with its upstream requests queued behind interactive ones."""
+    return run_as(Work(), fn, *args, **kwargs)
+
+# ---------------- LIMITER ----------------
+class Limiter:
+    """Concurrency slots plus a token bucket, handed out in priority order."""
+
+    def __init__(self, name, concurrency, rpm):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rpm / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.refilled = time.monotonic()
+        self.active = 0
+        self._waiting = []  # (work, arrival) tickets
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _token_wait(self):
+        """Take a token and return 0, or return seconds until one is due."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def _next(self):
+        """The ticket to serve next: by priority, then arrival."""
+        return min(self._waiting, key=lambda ticket: (ticket[0].level, ticket[1]))
+
+    def acquire(self, work, timeout):
+        """Wait for a slot and a token. Raises DeadlineExceeded after
+        timeout seconds, or Abandoned if the work is abandoned first."""
+        start = time.monotonic()
+        ticket = (work, next(self._arrivals))
+        with self._cond:
+            self._waiting.append(ticket)
+            metrics.observe(f"upstream_{self.name}_queue_depth", len(self._waiting))
+            try:
+                while True:
+                    if work.abandoned:
+                        raise Abandoned(f"gave up queueing for {self.name}")
+                    left = timeout - (time.monotonic() - start)
+                    if left <= 0:
+                        raise deadlines.DeadlineExceeded(f"queued for {self.name} past the deadline")
+                    pause = left
+                    if self._next() is ticket and self.active < self.concurrency:
+                        due = self._token_wait()
+                        if not due:
+                            break
+                        pause = min(due, left)
+                    self._cond.wait(pause)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+            self.active += 1
+        metrics.observe(f"upstream_{self.name}_wait_{PRIORITY_NAMES[work.level]}", time.monotonic() - start)
+
+    def try_acquire(self):
+        """Take a slot and a token only if both are free now and nobody is
+        queued for them; True if taken."""
+        with self._cond:
+            if self._waiting or self.active >= self.concurrency or self._token_wait():
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+_limiters = {name: Limiter(name, **limits) for name, limits in LIMITS.items()}
+
+def _wake_all():
+    for limiter in _limiters.values():
+        limiter.wake()
+
+@contextmanager
+def slot(endpoint, deadline=None, work=None):
+    """Hold one of endpoint's request slots, waiting for it in priority
+    order for up to the deadline (or the stage's budget without one).
+    work defaults to the caller's (see run_as).
+
+    Yields hand_over: calling it keeps the slot past the with block and
+    returns the function that frees it, for requests that may outlive
+    their caller.
+    """
+    limiter = _limiters[endpoint]
+    timeout = deadlines.STAGE_BUDGETS[endpoint] if deadline is None else deadline.remaining()
+    limiter.acquire(work or _work.get(), timeout)
+    metrics.inc(f"upstream_{endpoint}_requests")
+    handed = []
+
+    def hand_over():
+        handed.append(True)
+        return limiter.release
+
+    try:
+        yield hand_over
+    finally:
+        if not handed:
+            limiter.release()
+
+def spare(endpoint):
+    """A slot for an extra attempt (a hedge), only if one is free right now.
+    Returns the function that frees it, or None."""
+    limiter = _limiters[endpoint]
+    if not limiter.try_acquire():
+        return None
+    metrics.inc(f"upstream_{endpoint}_requests")
+    return limiter.release
+
+# ---------------- SINGLE-FLIGHT ----------------
+_flights_lock = threading.Lock()
+_flights = {}  # (endpoint, key) -> _Flight
+
+class _Flight:
+    """One request in flight and the callers sharing it."""
+
+    def __init__(self, work):
+        self.future = Future()
+        self.joint = _Joint(work)
+
+def request_key(*parts):
+    """Key under which identical requests are merged."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def call(endpoint, fn, *args, key=None, deadline=None, hedged=True, **kwargs):
+    """fn(*args, **kwargs) as one request to endpoint, within its limits.
+
+    With a key, joins an identical request already in flight instead of
+    sending another, promoting it if this caller is more urgent. If that
+    request is abandoned or runs out of its first caller's time, this
+    caller sends it again within its own deadline. hedged calls go
+    through deadlines.call once they have a slot. The hedge takes a slot
+    and a token of its own, and is skipped rather than queued when none
+    is free, so hedging never exceeds the endpoint's limits. Each slot is
+    freed once its attempt has finished, even after a timeout. Otherwise
+    only the deadline bounds the wait for a slot.
+    """
+    work = _work.get()
+    flight = None
+    while key is not None:
+        with _flights_lock:
+            flight = _flights.get((endpoint, key))
+            leader = flight is None
+            if leader:
+                flight = _flights[(endpoint, key)] = _Flight(work)
+        if leader:
+            break
+        flight.joint.join(work)
+        metrics.inc(f"upstream_{endpoint}_merged")
+        if deadline is None:
+            deadline = deadlines.Deadline(deadlines.STAGE_BUDGETS[endpoint])
+        budget = min(deadlines.STAGE_BUDGETS[endpoint], deadline.remaining())
+        try:
+            return flight.future.result(timeout=budget)
+        except (Abandoned, TimeoutError):
+            if not flight.future.done():
+                raise deadlines.DeadlineExceeded(f"{endpoint} took over {budget:.1f}s") from None
+            if work.abandoned:
+                raise
+        # The first caller gave up on its own account; ask again
+        metrics.inc(f"upstream_{endpoint}_reissued")
+
+    try:
+        with slot(endpoint, deadline, flight.joint if flight else work) as hand_over:
+            if hedged:
+                # Attempts left running past a timeout still hold the slot
+                result = deadlines.call(endpoint, fn, *args, deadline=deadline, settled=hand_over(),
+                                        spare=functools.partial(spare, endpoint), **kwargs)
+            else:
+                result = fn(*args, **kwargs)
+    except BaseException as e:
+        if flight:
+            _land(endpoint, key, flight, error=e)
+        raise
+    if flight:
+        _land(endpoint, key, flight, result=result)
+    return result
+
+def _land(endpoint, key, flight, result=None, error=None):
+    with _flights_lock:
+        _flights.pop((endpoint, key), None)
+    if error is not None:
+        flight.future.set_exception(error)
+    else:
+        flight.future.set_result(result)
+
+# ---------------- REPORTING ----------------
+def stats():
+    """Per endpoint: requests sent, requests merged, queue depth p95 and
+    queue wait p95 by priority."""
+    snapshot = metrics.snapshot()
+    result = {}
+    for endpoint in LIMITS:
+        waits = {
+            name: snapshot.get(f"upstream_{endpoint}_wait_{name}", {}).get("p95")
+            for name in PRIORITY_NAMES.values()
+        }
+        result[endpoint] = {
+            "requests": metrics.counters[f"upstream_{endpoint}_requests"],
+            "merged": metrics.counters[f"upstream_{endpoint}_merged"],
+            "queue_depth_p95": snapshot.get(f"upstream_{endpoint}_queue_depth", {}).get("p95"),
+            "wait_p95": waits,
+        }
+    return result
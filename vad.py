@@ -0,0 +1,163 @@
+"""Voice activity detection for recorded turns, stdlib only.
+
+The recorder stops after pause_threshold seconds of quiet, so every turn
+ends with that much silence, and often starts with some too. Frames are
+scored by RMS energy against the recording's own noise floor; only the
+speech (plus a little padding) goes on to transcription, and a recording
+with no speech at all skips it.
+
+Endpointing learns how long each child pauses mid-sentence and shortens
+the recorder's pause_threshold to match, so the turn ends sooner.
+"""
+import array
+import importlib.util
+import io
+import os
+import sys
+import wave
+from collections import deque
+
+# ---------------- CONFIG ----------------
+FRAME_MS = 20
+PAD_MS = 200  # kept either side of speech so soft word edges survive
+MIN_SPEECH_MS = 60  # shorter bursts (clicks, taps) are not speech
+MIN_LEVEL = 250  # RMS of 16-bit samples below which nothing counts as speech
+NOISE_MULTIPLIER = 3.0  # speech is this much louder than the quietest frames
+STT_CODEC = os.getenv("STT_CODEC", "wav")  # wav | flac (needs soundfile)
+
+DEFAULT_PAUSE_THRESHOLD = 2.0
+MIN_PAUSE_THRESHOLD = 1.2  # a learned threshold never cuts below this
+ENDPOINT_MARGIN = 0.4  # seconds beyond the longest pause seen mid-utterance
+ENDPOINT_TOLERANCE = 0.25  # trailing silence this close to the threshold means the recorder ended the turn
+
+# ---------------- DETECTION ----------------
+def _frame_levels(samples, frame_len):
+    levels = []
+    for start in range(0, len(samples) - frame_len + 1, frame_len):
+        frame = samples[start:start + frame_len]
+        levels.append((sum(s * s for s in frame) / frame_len) ** 0.5)
+    return levels
+
+def _speech_runs(levels, min_frames):
+    """(first, last) frame index of each run loud enough to be speech."""
+    ordered = sorted(levels)
+    floor = ordered[len(ordered) // 10]
+    threshold = max(MIN_LEVEL, floor * NOISE_MULTIPLIER)
+    runs, start = [], None
+    for i, level in enumerate(levels + [0.0]):
+        if level >= threshold and start is None:
+            start = i
+        elif level < threshold and start is not None:
+            if i - start >= min_frames:
+                runs.append((start, i - 1))
+            start = None
+    return runs
+
+def trim(wav_bytes):
+    """(audio, stats) for one recording.
+
+    audio is the WAV cut to its speech plus PAD_MS either side, None when
+    there is no speech, or the input unchanged if it is not 16-bit PCM.
+    stats has duration, speech, leading/trailing silence and the longest
+    pause inside speech, in seconds, and the number of speech runs (empty
+    if the input was not analyzed).
+    """
+    try:
+        with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            raw = w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        return wav_bytes, {}
+    if width != 2 or not raw:
+        return wav_bytes, {}
+
+    samples = array.array("h", raw[:len(raw) - len(raw) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if channels > 1:
+        samples = samples[::channels]  # First channel is enough to find speech
+    frame_len = max(1, rate * FRAME_MS // 1000)
+    levels = _frame_levels(samples, frame_len)
+    if not levels:
+        return wav_bytes, {}
+
+    frame_s = frame_len / rate
+    duration = len(samples) / rate
+    runs = _speech_runs(levels, max(1, MIN_SPEECH_MS // FRAME_MS))
+    if not runs and max(levels) >= MIN_LEVEL * NOISE_MULTIPLIER:
+        # Loud throughout (no quiet frames to set a floor): let STT decide
+        return wav_bytes, {}
+    if not runs:
+        return None, {"duration": duration, "speech": 0.0, "leading": duration,
+                      "trailing": duration, "longest_pause": 0.0, "runs": 0}
+
+    first, last = runs[0][0], runs[-1][1] + 1
+    pad = PAD_MS // FRAME_MS
+    begin, end = max(0, first - pad), min(len(levels), last + pad)
+    step = frame_len * channels * width
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(width)
+        w.setframerate(rate)
+        w.writeframes(raw[begin * step:end * step])
+    gaps = [b[0] - a[1] - 1 for a, b in zip(runs, runs[1:])]
+    return out.getvalue(), {
+        "duration": duration,
+        "speech": (last - first) * frame_s,
+        "leading": first * frame_s,
+        "trailing": duration - last * frame_s,
+        "longest_pause": max(gaps, default=0) * frame_s,
+        "runs": len(runs),
+    }
+
+# ---------------- UPLOAD ----------------
+def encode(wav_bytes):
+    """(filename, bytes, mime) for the upload: FLAC when STT_CODEC=flac and
+    soundfile is installed, the WAV as-is otherwise."""
+    if STT_CODEC == "flac" and importlib.util.find_spec("soundfile") is not None:
+        import soundfile
+
+        try:
+            data, rate = soundfile.read(io.BytesIO(wav_bytes), dtype="int16")
+            out = io.BytesIO()
+            soundfile.write(out, data, rate, format="FLAC")
+            return "input.flac", out.getvalue(), "audio/flac"
+        except Exception:
+            pass
+    return "input.wav", wav_bytes, "audio/wav"
+
+# ---------------- ENDPOINTING ----------------
+class Endpointing:
+    """Per-session recorder pause_threshold, learned from this child's
+    pauses mid-utterance. Starts at the default and never cuts below the
+    longest recent pause plus ENDPOINT_MARGIN, or MIN_PAUSE_THRESHOLD.
+
+    Only turns with at least two speech runs have a pause to learn from;
+    a one-word answer says nothing about how long the child pauses. A
+    one-run turn that the recorder ended on a learned threshold may have
+    been cut off mid-sentence, so the threshold goes back to the default
+    and is learned again.
+    """
+
+    def __init__(self, history=8):
+        self.pauses = deque(maxlen=history)
+
+    def update(self, stats):
+        """Learn from one turn's trim() stats, recorded at the current threshold."""
+        runs = stats.get("runs", 0)
+        if runs >= 2:
+            self.pauses.append(stats["longest_pause"])
+        elif runs == 1 and self._cut_off(stats):
+            self.pauses.clear()
+
+    def _cut_off(self, stats):
+        threshold = self.pause_threshold
+        return threshold < DEFAULT_PAUSE_THRESHOLD and stats["trailing"] >= threshold - ENDPOINT_TOLERANCE
+
+    @property
+    def pause_threshold(self):
+        if len(self.pauses) < 2:
+            return DEFAULT_PAUSE_THRESHOLD
+        learned = round(max(self.pauses) + ENDPOINT_MARGIN, 1)
+        return min(DEFAULT_PAUSE_THRESHOLD, max(MIN_PAUSE_THRESHOLD, learned))